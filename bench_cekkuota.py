@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# bench_cekkuota.py — benchmark cekkuota_bot.py tanpa menyentuh backend & Telegram asli
+# Server palsu (backend cek kuota + Bot API) jalan lokal dengan latensi, error rate,
+# injeksi 429 dan ukuran payload yang bisa diatur. Tiap skenario x ukuran armada
+# dijalankan di proses anak baru supaya RSS & state modul tidak saling bocor.
+#
+# Skenario:
+#   render  — QuotaReport.from_payload + fmt_result (tanpa jaringan)
+#   cron    — run_check_pipeline() (jalur yang sama dengan --cron)
+#   daemon  — daemon_run() menerima /cek_all lewat getUpdates palsu
+#
+# Contoh:
+#   python3 bench_cekkuota.py
+#   python3 bench_cekkuota.py --sizes 1,100,1000 --scenarios cron --latency 0.05 --error-rate 0.02
+#   python3 bench_cekkuota.py --tg-429 0.01 --real-limits --json /tmp/bench.json
+#   python3 bench_cekkuota.py --scenarios cron --transport urllib
+
+import os, sys, json, time, random, threading, argparse, subprocess, tempfile, shutil
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse, request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_TOKEN = "bench"
+BENCH_CHAT = "1"
+
+# ============= Server palsu (backend + Bot API) =============
+class FakeState:
+    """Konfigurasi & counter server palsu (diakses dari thread handler)"""
+    lock = threading.Lock()
+    latency = 0.02
+    jitter = 0.0
+    error_rate = 0.0
+    rate_429 = 0.0
+    tg_latency = 0.0
+    tg_429 = 0.0
+    packages = 3
+    benefits = 3
+    counters = {}
+    updates = []
+    next_update_id = 1
+
+    @classmethod
+    def count(cls, key: str, n: int = 1):
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + n
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.counters = {}
+            cls.updates = []
+
+def fake_quota_payload(packages: int, benefits: int) -> dict:
+    """Payload backend dengan `packages` paket x `benefits` benefit"""
+    quotas = []
+    for p in range(packages):
+        details = []
+        for i in range(benefits):
+            details.append({
+                "benefit": f"Kuota Internet {i + 1}",
+                "type": "DATA",
+                "total_quota": "10 GB",
+                "remaining_quota": f"{random.randint(1, 9000)} MB",
+                "used_percentage": f"{random.randint(0, 100)}%",
+            })
+        quotas.append({
+            "name": f"Paket Bench {p + 1}",
+            "expiry_date": "31 Desember 2030",
+            "details": details,
+        })
+    return {"status": True, "data": {"quotas": quotas}}
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Tanpa ini header & body terkirim terpisah dan Nagle + delayed ACK menambah ~40ms per request
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, obj, code=200, headers=None):
+        out = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(out)
+
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length", 0) or 0)
+        self._handle(self.rfile.read(n))
+
+    def _handle(self, body: bytes):
+        url = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(url.query))
+        path = url.path
+
+        if path == "/_stats":
+            with FakeState.lock:
+                return self._reply(dict(FakeState.counters))
+        if path == "/_reset":
+            FakeState.reset()
+            return self._reply({"ok": True})
+        if path == "/_update":
+            with FakeState.lock:
+                uid = FakeState.next_update_id
+                FakeState.next_update_id += 1
+                FakeState.updates.append({
+                    "update_id": uid,
+                    "message": {"chat": {"id": int(BENCH_CHAT)}, "text": query.get("text", "/ping")},
+                })
+            return self._reply({"ok": True, "update_id": uid})
+
+        if path.endswith("/cekkuota"):
+            return self._backend()
+        if path.startswith(f"/bot{BENCH_TOKEN}/"):
+            return self._telegram(path.rsplit("/", 1)[-1], query)
+        self._reply({"ok": False}, 404)
+
+    def _backend(self):
+        FakeState.count("backend_calls")
+        delay = FakeState.latency + random.uniform(0, FakeState.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < FakeState.rate_429:
+            FakeState.count("backend_429")
+            return self._reply({"status": False, "message": "rate limited"}, 429, {"Retry-After": "0"})
+        if roll < FakeState.rate_429 + FakeState.error_rate:
+            FakeState.count("backend_errors")
+            return self._reply({"status": False, "message": "fake error"}, 500)
+        self._reply(fake_quota_payload(FakeState.packages, FakeState.benefits))
+
+    def _telegram(self, method: str, query: dict):
+        FakeState.count("tg_calls")
+        FakeState.count(f"tg_{method}")
+        if method == "getUpdates":
+            return self._get_updates(query)
+        if FakeState.tg_latency > 0:
+            time.sleep(FakeState.tg_latency)
+        if method == "sendMessage" and random.random() < FakeState.tg_429:
+            FakeState.count("tg_429")
+            return self._reply({"ok": False, "error_code": 429, "parameters": {"retry_after": 1}}, 429)
+        self._reply({"ok": True, "result": {"message_id": 1}})
+
+    def _get_updates(self, query: dict):
+        offset = int(query.get("offset", "0") or "0")
+        wait = min(float(query.get("timeout", "0") or "0"), 0.5)
+        if offset > 0:
+            FakeState.count("polls")
+        end = time.time() + wait
+        while True:
+            with FakeState.lock:
+                if offset < 0:
+                    result = FakeState.updates[offset:]
+                else:
+                    result = [u for u in FakeState.updates if u["update_id"] >= offset]
+            if result or time.time() >= end:
+                break
+            time.sleep(0.01)
+        self._reply({"ok": True, "result": result})
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, req, client_address):
+        # Long polling yang diputus saat proses anak selesai bukan error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(req, client_address)
+
+def start_fake_server():
+    server = FakeServer(("127.0.0.1", 0), FakeHandler)
+    threading.Thread(target=server.serve_forever, name="fake-server", daemon=True).start()
+    return server
+
+def fake_call(base: str, path: str) -> dict:
+    with request.urlopen(base + path, timeout=10) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+# ============= Proses anak: jalankan jalur kode asli =============
+def peak_rss_kb() -> int:
+    try:
+        import resource
+        return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    except Exception:
+        return 0
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def load_bot(args, size: int):
+    """Import cekkuota_bot dengan env benchmark; backend & Telegram diarahkan ke server palsu lewat config"""
+    state_dir = tempfile.mkdtemp(prefix="cekkuota-bench-")
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "CHAT_ID": BENCH_CHAT,
+        "MSISDN_LIST": ",".join(f"0812{i:08d}" for i in range(size)),
+        "STATE_DIR": state_dir,
+        "API_URL": args.base + "/cekkuota",
+        "TELEGRAM_API_URL": args.base,
+        "HTTP_TRANSPORT": args.transport,
+        "CHECK_WORKERS": str(args.workers),
+        "RUN_BUDGET": "0",
+        "METRICS_PORT": "0",
+        "METRICS_DUMP_INTERVAL": "0",
+    })
+    if not args.real_limits:
+        os.environ.update({"TG_CHAT_RATE": "10000", "TG_CHAT_BURST": "10000", "TG_GLOBAL_RATE": "10000"})
+
+    sys.path.insert(0, HERE)
+    import cekkuota_bot as bot
+
+    # Latensi per nomor diukur persis di worker engine
+    durations = []
+    orig_check_one = bot._check_one
+
+    def timed_check_one(msisdn, deadline=None):
+        t0 = time.perf_counter()
+        try:
+            return orig_check_one(msisdn, deadline)
+        finally:
+            durations.append(time.perf_counter() - t0)
+
+    bot._check_one = timed_check_one
+    return bot, durations, state_dir
+
+def child_render(args, size: int) -> dict:
+    sys.path.insert(0, HERE)
+    import cekkuota_bot as bot
+    payload = fake_quota_payload(args.packages, args.benefits)
+    durations = []
+    t0 = time.perf_counter()
+    for i in range(size):
+        t = time.perf_counter()
+        report = bot.QuotaReport.from_payload(payload)
+        bot.fmt_result(f"6281{i:09d}", 200, report)
+        durations.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t0
+    return {"elapsed": elapsed, "durations": durations, "tg": {}, "ok": size}
+
+def child_cron(args, size: int) -> dict:
+    bot, durations, state_dir = load_bot(args, size)
+    try:
+        fake_call(args.base, "/_reset")
+        t0 = time.perf_counter()
+        bot.run_check_pipeline("BENCH")
+        elapsed = time.perf_counter() - t0
+        ok = bot.METRICS.counter_values("backend_responses_total").get((("status", "200"),), 0)
+        return {"elapsed": elapsed, "durations": durations, "tg": fake_call(args.base, "/_stats"), "ok": ok}
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+def child_daemon(args, size: int) -> dict:
+    bot, durations, state_dir = load_bot(args, size)
+    try:
+        threading.Thread(target=bot.daemon_run, name="daemon", daemon=True).start()
+        # Tunggu sampai daemon selesai bootstrap dan masuk long polling
+        limit = time.time() + 30
+        while fake_call(args.base, "/_stats").get("polls", 0) < 1:
+            if time.time() > limit:
+                raise RuntimeError("daemon tidak mulai polling")
+            time.sleep(0.01)
+
+        fake_call(args.base, "/_reset")
+        t0 = time.perf_counter()
+        fake_call(args.base, "/_update?text=%2Fcek_all")
+        while True:
+            hist = bot.METRICS.histogram("command_seconds", command="/cek_all")
+            if hist is not None and hist.count:
+                break
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - t0
+        ok = bot.METRICS.counter_values("backend_responses_total").get((("status", "200"),), 0)
+        return {"elapsed": elapsed, "durations": durations, "tg": fake_call(args.base, "/_stats"), "ok": ok}
+    finally:
+        # state.json tertunda ditulis sekarang, bukan oleh atexit setelah STATE_DIR dihapus
+        bot.flush_state()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+CHILD_SCENARIOS = {"render": child_render, "cron": child_cron, "daemon": child_daemon}
+
+def run_child(args):
+    """Entry point proses anak; hasil ditulis sebagai JSON ke --out"""
+    real_stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        res = CHILD_SCENARIOS[args.child](args, args.size)
+    finally:
+        if sys.stdout is not real_stdout:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+    durations = res["durations"]
+    tg = res["tg"]
+    result = {
+        "scenario": args.child,
+        "size": args.size,
+        "ok": res["ok"],
+        "elapsed_s": round(res["elapsed"], 4),
+        "per_sec": round(args.size / res["elapsed"], 2) if res["elapsed"] > 0 else 0.0,
+        "p50_ms": round(percentile(durations, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 3),
+        "peak_rss_kb": peak_rss_kb(),
+        "tg_calls": tg.get("tg_calls", 0) - tg.get("tg_getUpdates", 0),
+        "tg_429": tg.get("tg_429", 0),
+        "backend_calls": tg.get("backend_calls", 0),
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f)
+
+# ============= Proses induk: orkestrasi & laporan =============
+def run_case(args, scenario: str, size: int) -> dict:
+    fd, out = tempfile.mkstemp(prefix="cekkuota-bench-", suffix=".json")
+    os.close(fd)
+    cmd = [
+        sys.executable, os.path.abspath(__file__),
+        "--child", scenario, "--size", str(size), "--out", out, "--base", args.base,
+        "--workers", str(args.workers), "--transport", args.transport, "--packages", str(args.packages), "--benefits", str(args.benefits),
+    ]
+    if args.real_limits:
+        cmd.append("--real-limits")
+    if args.verbose:
+        cmd.append("--verbose")
+    FakeState.reset()
+    try:
+        proc = subprocess.run(cmd)
+        if proc.returncode != 0:
+            return {"scenario": scenario, "size": size, "error": f"exit {proc.returncode}"}
+        with open(out) as f:
+            return json.load(f)
+    finally:
+        try:
+            os.remove(out)
+        except OSError:
+            pass
+
+def print_row(r: dict):
+    if "error" in r:
+        print(f"{r['scenario']:<7} {r['size']:>6}  GAGAL ({r['error']})")
+        return
+    print(f"{r['scenario']:<7} {r['size']:>6} {r['ok']:>6} {r['elapsed_s']:>9.3f} {r['per_sec']:>10.1f} "
+          f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['peak_rss_kb'] / 1024:>8.1f} "
+          f"{r['tg_calls']:>7} {r['tg_429']:>5} {r['backend_calls']:>8}")
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark cekkuota_bot.py dengan server backend & Telegram palsu")
+    ap.add_argument("--sizes", default="1,10,100,1000,10000", help="ukuran armada (jumlah nomor), pisah koma")
+    ap.add_argument("--scenarios", default="render,cron,daemon", help="render,cron,daemon")
+    ap.add_argument("--latency", type=float, default=0.02, help="latensi backend palsu (detik)")
+    ap.add_argument("--jitter", type=float, default=0.0, help="tambahan latensi acak 0..N detik")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="peluang backend membalas 500")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="peluang backend membalas 429")
+    ap.add_argument("--tg-latency", type=float, default=0.0, help="latensi Bot API palsu (detik)")
+    ap.add_argument("--tg-429", type=float, default=0.0, help="peluang sendMessage dibalas 429 (retry_after=1)")
+    ap.add_argument("--packages", type=int, default=3, help="jumlah paket per nomor di payload")
+    ap.add_argument("--benefits", type=int, default=3, help="jumlah benefit per paket")
+    ap.add_argument("--workers", type=int, default=4, help="CHECK_WORKERS")
+    ap.add_argument("--transport", default="pool", choices=("pool", "urllib"), help="HTTP_TRANSPORT bot")
+    ap.add_argument("--real-limits", action="store_true", help="pakai rate limit Telegram bawaan (default: dilonggarkan)")
+    ap.add_argument("--json", help="simpan hasil ke file JSON")
+    ap.add_argument("--verbose", action="store_true", help="tampilkan log bot")
+    # internal: proses anak
+    ap.add_argument("--child", choices=sorted(CHILD_SCENARIOS), help=argparse.SUPPRESS)
+    ap.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--out", help=argparse.SUPPRESS)
+    ap.add_argument("--base", help=argparse.SUPPRESS)
+    return ap.parse_args(argv)
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    FakeState.latency = args.latency
+    FakeState.jitter = args.jitter
+    FakeState.error_rate = args.error_rate
+    FakeState.rate_429 = args.rate_429
+    FakeState.tg_latency = args.tg_latency
+    FakeState.tg_429 = args.tg_429
+    FakeState.packages = args.packages
+    FakeState.benefits = args.benefits
+
+    server = start_fake_server()
+    args.base = f"http://127.0.0.1:{server.server_port}"
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    scenarios = [x.strip() for x in args.scenarios.split(",") if x.strip()]
+    unknown = [s for s in scenarios if s not in CHILD_SCENARIOS]
+    if unknown:
+        sys.exit(f"Skenario tidak dikenal: {', '.join(unknown)}")
+
+    print(f"# backend latency={args.latency}s jitter={args.jitter}s error={args.error_rate} 429={args.rate_429} "
+          f"| tg latency={args.tg_latency}s 429={args.tg_429} | payload {args.packages}x{args.benefits} "
+          f"| workers={args.workers} transport={args.transport}{' | real limits' if args.real_limits else ''}")
+    print(f"{'skenario':<7} {'nomor':>6} {'sukses':>6} {'durasi_s':>9} {'nomor/s':>10} "
+          f"{'p50_ms':>9} {'p99_ms':>9} {'rss_mb':>8} {'tg_call':>7} {'tg429':>5} {'backend':>8}")
+
+    results = []
+    for scenario in scenarios:
+        for size in sizes:
+            r = run_case(args, scenario, size)
+            results.append(r)
+            print_row(r)
+
+    server.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("child", "size", "out")},
+                       "results": results}, f, indent=2)
+        print(f"# hasil disimpan ke {args.json}")
+
+if __name__ == "__main__":
+    main()
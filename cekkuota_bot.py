@@ -1,374 +1,3332 @@
 #!/usr/bin/env python3
 # cekkuota_bot.py — Bot Telegram + cron-friendly (stdlib only)
-# Perintah: /start, /mbot (menu), /cek <msisdn>, /cek_all, /jadwal, /ping
+# Perintah: /start, /mbot (menu), /cek <msisdn>, /cek_all, /laporan, /nomor, /jadwal, /riwayat <msisdn>,
+#           /stats, /log, /ping
+# Tombol inline (callback_query): pilih nomor & refresh hasil cek di pesan yang sama
 # Startup: kirim notifikasi "Bot aktif", deleteWebhook, sync offset
+# Mode: daemon long polling (default), --async (daemon asyncio), --webhook, --cron, --report
 
-import os, sys, json, time, re, traceback
-from urllib import request, parse, error
+import time
+_STARTUP = [("start", time.perf_counter())]
+
+# Modul berat yang hanya dipakai sebagian mode (asyncio, concurrent.futures, traceback,
+# urllib.request, http.server, zoneinfo) di-import di dalam fungsi yang membutuhkannya.
+import os, sys, json, re, threading, ssl, random, heapq
+import http.client
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from collections import deque, OrderedDict
+from urllib import parse
+_STARTUP.append(("import", time.perf_counter()))
 
 # ================== KONSTAN API (public) ==================
-API_URL = "https://cekkuota-pubs.fadzdigital.store/cekkuota"
+DEFAULT_API_URL = "https://cekkuota-pubs.fadzdigital.store/cekkuota"
+DEFAULT_TELEGRAM_API_URL = "https://api.telegram.org"
 EDGE_HEADER_KEY = "019a00a6-f36c-743f-cff4-fcd7abba5a07"
+USER_AGENT = "cekkuota-bot/1.5"
 # ==========================================================
 
 BOT_TOKEN   = os.getenv("BOT_TOKEN", "").strip()
+API_URL     = os.getenv("API_URL", "").strip() or DEFAULT_API_URL
+TELEGRAM_API_URL = (os.getenv("TELEGRAM_API_URL", "").strip() or DEFAULT_TELEGRAM_API_URL).rstrip("/")
+HTTP_TRANSPORT = os.getenv("HTTP_TRANSPORT", "pool").strip().lower() or "pool"
 CHAT_IDS    = [x.strip() for x in os.getenv("CHAT_ID", "").split(",") if x.strip()]
-MSISDNS     = [x.strip() for x in os.getenv("MSISDN_LIST", "").split(",") if x.strip()]
+RAW_MSISDNS = [x.strip() for x in os.getenv("MSISDN_LIST", "").split(",") if x.strip()]
 
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "12") or "12")
-RETRIES = int(os.getenv("RETRIES", "1") or "1")
+RETRIES = int(os.getenv("RETRIES", "2") or "2")
+BACKOFF_BASE = float(os.getenv("BACKOFF_BASE", "0.5") or "0.5")
+BACKOFF_MAX = float(os.getenv("BACKOFF_MAX", "8") or "8")
+CB_WINDOW = int(os.getenv("CB_WINDOW", "20") or "20")
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "10") or "10")
+CB_ERROR_RATE = float(os.getenv("CB_ERROR_RATE", "0.5") or "0.5")
+CB_COOLDOWN = float(os.getenv("CB_COOLDOWN", "30") or "30")
+RUN_BUDGET = float(os.getenv("RUN_BUDGET", "600") or "600")
+BUILTIN_SCHEDULER = os.getenv("SCHEDULER_MODE", "cron").strip().lower() == "builtin"
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0") or "0")
+SCHEDULE_CATCHUP = float(os.getenv("SCHEDULE_CATCHUP", "21600") or "21600")
 TZ = os.getenv("TZ", "Asia/Jakarta")
 DEFAULT_SCHEDULES = "10 0 * * *,30 5 * * *,30 11 * * *,30 17 * * *,30 22 * * *"
 SCHEDULES = [s.strip() for s in (os.getenv("SCHEDULES", DEFAULT_SCHEDULES) or DEFAULT_SCHEDULES).split(",") if s.strip()]
 ALLOW_ANY_CHAT = os.getenv("ALLOW_ANY_CHAT", "0") == "1"
 STATE_DIR = os.getenv("STATE_DIR", "/root/cek-kuota").rstrip("/")
+CHECK_WORKERS = int(os.getenv("CHECK_WORKERS", "4") or "4")
+HOST_CONCURRENCY = int(os.getenv("HOST_CONCURRENCY", "4") or "4")
+POOL_IDLE_TIMEOUT = float(os.getenv("POOL_IDLE_TIMEOUT", "30") or "30")
+POOL_MAX_IDLE = int(os.getenv("POOL_MAX_IDLE", "4") or "4")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60") or "60")
+CACHE_MAX = int(os.getenv("CACHE_MAX", "512") or "512")
+CACHE_SNAPSHOT = os.getenv("CACHE_SNAPSHOT", "0") == "1"
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25") or "25")
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1") or "1")
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3") or "3")
+TG_RETRIES = int(os.getenv("TG_RETRIES", "3") or "3")
+TG_MAX_RETRY_AFTER = float(os.getenv("TG_MAX_RETRY_AFTER", "60") or "60")
+DAEMON_MODE = os.getenv("DAEMON_MODE", "poll").strip().lower()
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+HISTORY_MAX_KB = int(os.getenv("HISTORY_MAX_KB", "1024") or "1024")
+HISTORY_KEEP = int(os.getenv("HISTORY_KEEP", "50") or "50")
+CRON_DELTA = os.getenv("CRON_DELTA", "0") == "1"
+DELTA_MIN_MB = float(os.getenv("DELTA_MIN_MB", "100") or "100")
+DELTA_MIN_PERCENT = float(os.getenv("DELTA_MIN_PERCENT", "5") or "5")
+ALERT_ENABLED = os.getenv("ALERT_ENABLED", "0") == "1"
+ALERT_MIN_MB = float(os.getenv("ALERT_MIN_MB", "0") or "0")
+ALERT_MIN_PERCENT = float(os.getenv("ALERT_MIN_PERCENT", "10") or "10")
+ALERT_EXPIRY_DAYS = float(os.getenv("ALERT_EXPIRY_DAYS", "1") or "1")
+ASYNC_MAX_TASKS = int(os.getenv("ASYNC_MAX_TASKS", "8") or "8")
+ASYNC_PER_CHAT = int(os.getenv("ASYNC_PER_CHAT", "1") or "1")
+WORK_WORKERS = int(os.getenv("WORK_WORKERS", "2") or "2")
+WORK_PER_CHAT = int(os.getenv("WORK_PER_CHAT", "1") or "1")
+WORK_QUEUE_MAX = int(os.getenv("WORK_QUEUE_MAX", "32") or "32")
+CMD_RATE = float(os.getenv("CMD_RATE", "0.5") or "0.5")
+CMD_BURST = float(os.getenv("CMD_BURST", "5") or "5")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "").strip()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip() or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080") or "8080")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", "1048576") or "1048576")
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT", "").strip()
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY", "").strip()
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "5") or "5")
+STATE_FSYNC = os.getenv("STATE_FSYNC", "1") != "0"
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "3") or "3")
+REPORT_FORMAT = os.getenv("REPORT_FORMAT", "csv").strip().lower() or "csv"
+TENANTS_FILE = os.getenv("TENANTS_FILE", "").strip()
+TENANT_WORKERS = int(os.getenv("TENANT_WORKERS", "2") or "2")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or "0")
+METRICS_BIND = os.getenv("METRICS_BIND", "127.0.0.1").strip() or "127.0.0.1"
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "0") or "0")
 
-if not os.path.isdir(STATE_DIR):
-    try:
-        os.makedirs(STATE_DIR, exist_ok=True)
-    except Exception as e:
-        print(f"[WARNING] Tidak bisa membuat STATE_DIR: {e}")
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "0") or "0")
+ENV_FILE = os.getenv("ENV_FILE", "/root/cekkuota.env").strip()
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "30") or "30")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").strip().lower() or "info"
+LOG_FILE = os.getenv("LOG_FILE", "").strip()
+LOG_MAX_KB = int(os.getenv("LOG_MAX_KB", "256") or "256")
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "1") or "1")
+LOG_BUFFER = int(os.getenv("LOG_BUFFER", "500") or "500")
+LOG_TAG_RATE = int(os.getenv("LOG_TAG_RATE", "20") or "20")
+_STARTUP.append(("config", time.perf_counter()))
+
+# ============= Logging =============
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+_LOG_LEVEL_NAMES = {v: k.upper() for k, v in LOG_LEVELS.items()}
+
+class Logger:
+    """Log ringan: tiap baris masuk ring buffer (untuk /log) lalu ditulis thread latar secara batch.
+    Tujuan: stdout (default) atau LOG_FILE dengan rotasi ukuran; baris di bawah WARNING
+    dibatasi `tag_rate` baris/detik per [TAG] agar log tidak membanjir saat beban tinggi"""
+
+    def __init__(self, level: str = "info", path: str = "", max_bytes: int = 256 * 1024,
+                 backups: int = 1, buffer: int = 500, tag_rate: int = 20, queue_max: int = 2000):
+        self.level = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self.tag_rate = tag_rate
+        self.recent = deque(maxlen=max(1, buffer))
+        self.dropped = 0
+        self._reported = 0
+        self._queue = deque(maxlen=max(1, queue_max))
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._windows = {}
+        self._thread = None
+        self._file = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Thread writer & lock milik proses induk tidak ikut ke proses anak (multi-tenant);
+        # antrian dikosongkan agar baris yang belum ditulis induk tidak tertulis dua kali
+        self._queue = deque(maxlen=self._queue.maxlen)
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._file = None
+
+    def debug(self, text: str):
+        self.log(10, text)
+
+    def info(self, text: str):
+        self.log(20, text)
+
+    def warning(self, text: str):
+        self.log(30, text)
+
+    def error(self, text: str):
+        self.log(40, text)
+
+    def log(self, level: int, text: str):
+        if level < self.level:
+            return
+        entry = (time.time(), level, text)
+        self.recent.append(entry)
+        with self._cond:
+            if level < 30 and self.tag_rate > 0 and not self._sample_locked(text, entry[0]):
+                self.dropped += 1
+                return
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(entry)
+            if self._thread is None:
+                import atexit
+                atexit.register(self.flush)
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _sample_locked(self, text: str, now: float) -> bool:
+        """Batas baris per detik per [TAG]"""
+        tag = text[1:text.find("]")] if text.startswith("[") else ""
+        sec = int(now)
+        window = self._windows.get(tag)
+        if window is None or window[0] != sec:
+            self._windows[tag] = [sec, 1]
+            return True
+        window[1] += 1
+        return window[1] <= self.tag_rate
+
+    def _take_locked(self):
+        batch = list(self._queue)
+        self._queue.clear()
+        dropped = self.dropped - self._reported
+        self._reported = self.dropped
+        return batch, dropped
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch, dropped = self._take_locked()
+            self._write(batch, dropped)
+
+    def flush(self):
+        """Tulis antrian sekarang juga (dipanggil saat proses berhenti)"""
+        with self._cond:
+            batch, dropped = self._take_locked()
+        if batch or dropped:
+            self._write(batch, dropped)
+
+    def _write(self, batch, dropped: int):
+        blob = "".join(fmt_log_entry(e) + "\n" for e in batch)
+        if dropped:
+            blob += fmt_log_entry((time.time(), 30, f"[LOG] {dropped} baris dilewati (sampling/antrian penuh)")) + "\n"
+        with self._write_lock:
+            try:
+                if not self.path:
+                    sys.stdout.write(blob)
+                    sys.stdout.flush()
+                    return
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                if self.max_bytes > 0 and self._file.tell() + len(blob) > self.max_bytes:
+                    self._rotate()
+                self._file.write(blob)
+                self._file.flush()
+            except Exception:
+                pass
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def tail(self, n: int = 20, level: int = 10) -> list:
+        """N entri terakhir dari memori dengan level >= `level`"""
+        entries = [e for e in list(self.recent) if e[1] >= level]
+        return entries[-n:] if n > 0 else []
+
+def fmt_log_entry(entry, short: bool = False) -> str:
+    """Satu baris log; short=True untuk /log (jam saja, level 1 huruf)"""
+    ts, level, text = entry
+    name = _LOG_LEVEL_NAMES.get(level, "?")
+    if short:
+        return f"{datetime.fromtimestamp(ts):%H:%M:%S} {name[0]} {text}"
+    return f"{datetime.fromtimestamp(ts):%Y-%m-%d %H:%M:%S} {name:<7} {text}"
+
+def fmt_log_tail(n: int = 20, level: int = 10) -> str:
+    """Isi /log: entri terakhir dari ring buffer (tanpa baca file)"""
+    entries = LOG.tail(n, level)
+    if not entries:
+        return "📜 *LOG*\n\n_Belum ada entri_"
+    lines = [fmt_log_entry(e, short=True).replace("`", "'")[:300] for e in entries]
+    head = f"📜 *LOG* ({len(entries)} entri terakhir"
+    if LOG.dropped:
+        head += f", {LOG.dropped} baris dilewati"
+    return head + ")\n```\n" + "\n".join(lines) + "\n```"
+
+LOG = Logger(LOG_LEVEL, LOG_FILE, LOG_MAX_KB * 1024, LOG_BACKUPS, LOG_BUFFER, LOG_TAG_RATE)
 
 # ============= Util dasar =============
-def valid_msisdn(s: str) -> bool:
-    """Validasi format MSISDN Indonesia"""
+def ensure_state_dir():
+    """Buat STATE_DIR saat mode yang menulis state dijalankan (bukan saat import)"""
+    if not os.path.isdir(STATE_DIR):
+        try:
+            os.makedirs(STATE_DIR, exist_ok=True)
+        except Exception as e:
+            LOG.warning(f"[WARNING] Tidak bisa membuat STATE_DIR: {e}")
+
+def format_exc() -> str:
+    """traceback.format_exc(); modul traceback baru di-import saat benar-benar ada error"""
+    import traceback
+    return traceback.format_exc()
+
+def _process_age_ms():
+    """Umur proses sejak exec (Linux /proc, resolusi tick kernel) -> ms atau None"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            start_ticks = int(f.read().rsplit(b")", 1)[1].split()[19])
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, (uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000)
+    except Exception:
+        return None
+
+def startup_report() -> str:
+    """Rincian waktu cold start: import, config, init modul, sampai mode dimulai"""
+    marks = _STARTUP + [("mode", time.perf_counter())]
+    parts = [f"{name}={(t - prev) * 1000:.1f}ms" for (_, prev), (name, t) in zip(marks, marks[1:])]
+    total = (marks[-1][1] - marks[0][1]) * 1000
+    age = _process_age_ms()
+    line = " ".join(parts) + f" total={total:.1f}ms"
+    if age is not None:
+        line += f" (proses≈{age:.0f}ms termasuk interpreter)"
+    if STARTUP_BUDGET_MS > 0 and total > STARTUP_BUDGET_MS:
+        line += f" ⚠️ melebihi budget {STARTUP_BUDGET_MS:.0f}ms"
+    return line
+
+# 08xxx, 628xxx dan +628xxx -> bagian setelah kode negara/awalan 0
+MSISDN_RE = re.compile(r"^(?:\+62|62|0)(8[1-9][0-9]{7,11})$")
+_MSISDN_JUNK_RE = re.compile(r"[\s\-.()]")
+
+def normalize_msisdn(s: str):
+    """Normalisasi MSISDN Indonesia ke bentuk kanonik 628xxx, None jika tidak valid"""
     if not s:
-        return False
+        return None
     # Hapus spasi dan karakter khusus
-    s = str(s).strip()
-    return bool(re.match(r"^(08[1-9][0-9]{7,11}|628[1-9][0-9]{7,11}|\+628[1-9][0-9]{7,11})$", s))
+    m = MSISDN_RE.match(_MSISDN_JUNK_RE.sub("", str(s)))
+    return "62" + m.group(1) if m else None
+
+def valid_msisdn(s: str) -> bool:
+    """Validasi format MSISDN Indonesia"""
+    return normalize_msisdn(s) is not None
+
+class MsisdnIndex:
+    """Daftar nomor pantau: dinormalisasi, tanpa duplikat, divalidasi sekali saat load"""
+
+    def __init__(self, raw_list):
+        self.numbers = []
+        self.invalid = []
+        self.duplicates = 0
+        self._seen = set()
+        for raw in raw_list:
+            msisdn = normalize_msisdn(raw)
+            if msisdn is None:
+                self.invalid.append(raw)
+            elif msisdn in self._seen:
+                self.duplicates += 1
+            else:
+                self._seen.add(msisdn)
+                self.numbers.append(msisdn)
+
+    def __contains__(self, msisdn):
+        return normalize_msisdn(msisdn) in self._seen
+
+    def diff(self, old: "MsisdnIndex"):
+        """(ditambah, dihapus) dibanding daftar lama"""
+        return ([m for m in self.numbers if m not in old._seen],
+                [m for m in old.numbers if m not in self._seen])
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        return iter(self.numbers)
+
+    def report(self):
+        """Log nomor yang ditolak/digabung (sekali, saat load)"""
+        if self.invalid:
+            LOG.info(f"[MSISDN] {len(self.invalid)} nomor tidak valid diabaikan: {', '.join(self.invalid)}")
+        if self.duplicates:
+            LOG.info(f"[MSISDN] {self.duplicates} nomor duplikat digabung")
+
+MSISDN_INDEX = MsisdnIndex(RAW_MSISDNS)
+MSISDN_INDEX.report()
+MSISDNS = MSISDN_INDEX.numbers
+
+# ============= State store (state.json) =============
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+
+class StateStore:
+    """State kecil (offset, snapshot cache, jadwal terakhir) dalam satu file JSON.
+    Perubahan dikumpulkan di memori lalu ditulis sekaligus (tmp + fsync + rename);
+    versi sebelumnya disimpan sebagai .bak untuk cadangan jika file utama rusak.
+    File yang sama bisa dipakai beberapa proses (daemon & --cron), jadi flush hanya menulis kunci
+    yang diubah proses ini, digabung ke isi file terbaru di bawah kunci file"""
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        for candidate in (self.path, self.path + ".bak"):
+            try:
+                with open(candidate, "r") as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("bukan objek JSON")
+                if candidate != self.path:
+                    LOG.info(f"[STATE] {self.path} tidak terbaca, memakai cadangan {candidate}")
+                return data
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                LOG.error(f"[STATE_LOAD_ERROR] {candidate}: {e}")
+        return {}
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key: str, value, durable: bool = False):
+        """Ubah satu kunci; durable=True langsung ditulis ke disk, selain itu menunggu flush berikutnya"""
+        with self._lock:
+            if self._data.get(key) == value:
+                return
+            self._data[key] = value
+            self._changed.add(key)
+        if durable or STATE_FLUSH_INTERVAL <= 0:
+            self.flush()
+        else:
+            _start_state_flusher()
+
+    def flush(self) -> bool:
+        """Tulis ke disk jika ada perubahan; True jika file ditulis"""
+        with self._lock:
+            if not self._changed:
+                return False
+            changed = {k: self._data[k] for k in self._changed}
+            self._changed.clear()
+        tmp = self.path + ".tmp"
+        try:
+            with _file_lock(self.path + ".lock"):
+                # Isi terbaru di disk (mis. offset dari daemon) + kunci yang diubah proses ini
+                data = self._load()
+                data.update(changed)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                if os.path.exists(self.path):
+                    os.replace(self.path, self.path + ".bak")
+                os.replace(tmp, self.path)
+                if self.fsync:
+                    _fsync_dir(os.path.dirname(self.path) or ".")
+            with self._lock:
+                for k, v in data.items():
+                    if k not in self._changed:
+                        self._data[k] = v
+            self.writes += 1
+            return True
+        except Exception as e:
+            with self._lock:
+                self._changed.update(k for k in changed if k not in self._changed)
+            LOG.error(f"[STATE_SAVE_ERROR] {e}")
+            return False
+
+@contextmanager
+def _file_lock(path: str):
+    """Kunci eksklusif antar-proses (flock) selama blok berjalan; tanpa fcntl (Windows) tidak mengunci"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _fsync_dir(path: str):
+    """fsync direktori agar rename ikut tersimpan (diabaikan jika tidak didukung)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+_STATE_STORES = {}
+_STATE_LOCK = threading.Lock()
+_STATE_FLUSHER = None
+
+def state_store(path: str = None) -> StateStore:
+    """StateStore untuk `path` (default STATE_FILE), satu objek per file dalam proses ini"""
+    path = path or STATE_FILE
+    with _STATE_LOCK:
+        store = _STATE_STORES.get(path)
+        if store is None:
+            store = _STATE_STORES[path] = StateStore(path, STATE_FSYNC)
+        return store
+
+def flush_state():
+    """Tulis semua state yang tertunda (interval flush & saat proses berhenti)"""
+    with _STATE_LOCK:
+        stores = list(_STATE_STORES.values())
+    for store in stores:
+        store.flush()
+
+def _state_flush_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        flush_state()
+
+def _start_state_flusher():
+    global _STATE_FLUSHER
+    if _STATE_FLUSHER is not None:
+        return
+    with _STATE_LOCK:
+        if _STATE_FLUSHER is None:
+            _STATE_FLUSHER = threading.Thread(target=_state_flush_loop, args=(STATE_FLUSH_INTERVAL,),
+                                              name="state-flush", daemon=True)
+            _STATE_FLUSHER.start()
+
+def read_legacy_state(path: str):
+    """Isi file state lama (sebelum state.json) atau None; dipakai sekali untuk migrasi"""
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOG.error(f"[STATE_LOAD_ERROR] {path}: {e}")
+        return None
+
+def init_state():
+    """Siapkan STATE_DIR dan pastikan state tertunda ditulis saat proses berhenti (exit/SIGTERM)"""
+    import atexit
+    import signal
+    ensure_state_dir()
+    atexit.register(flush_state)
+    if threading.current_thread() is threading.main_thread():
+        try:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        except (ValueError, OSError):
+            pass
+
+# ============= Metrik & instrumentasi =============
+METRICS_FILE = os.path.join(STATE_DIR, "metrics.json")
+KNOWN_COMMANDS = ("/start", "/mbot", "/menu", "/ping", "/jadwal", "/cek_all", "/riwayat", "/cek", "/stats",
+                  "/nomor", "/log", "/laporan", "callback")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Histogram latensi dengan bucket tetap (murah: satu bisect + increment per observasi)"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = array("L", [0] * (len(buckets) + 1))
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Perkiraan kuantil (interpolasi linear di dalam bucket)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.buckets[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "buckets": list(self.counts),
+        }
+
+class Metrics:
+    """Counter & histogram berlabel; diekspor ke Prometheus, /stats, dan JSON"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, n: int = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def histogram(self, name: str, **labels):
+        with self._lock:
+            return self.histograms.get(self._key(name, labels))
+
+    def counter_values(self, name: str) -> dict:
+        """{label-tuple: nilai} untuk satu nama counter"""
+        with self._lock:
+            return {k[1]: v for k, v in self.counters.items() if k[0] == name}
+
+    def collected(self) -> list:
+        """Metrik yang sudah dihitung komponen lain (pool, cache, backend) -> [(nama, tipe, nilai)]"""
+        pool = TRANSPORT.stats()
+        cache = QUOTA_CACHE.stats()
+        backend = backend_stats()
+        work = work_stats()
+        return [
+            ("uptime_seconds", "gauge", round(time.time() - self.started, 3)),
+            ("backend_calls_total", "counter", backend["calls"]),
+            ("backend_retries_total", "counter", backend["retries"]),
+            ("backend_failures_total", "counter", backend["failures"]),
+            ("backend_breaker_rejected_total", "counter", backend["rejected"]),
+            ("backend_breaker_open", "gauge", int(backend["breaker"] != "closed")),
+            ("cache_hits_total", "counter", cache["hits"]),
+            ("cache_misses_total", "counter", cache["misses"]),
+            ("cache_coalesced_total", "counter", cache["coalesced"]),
+            ("cache_size", "gauge", cache["size"]),
+            ("pool_hits_total", "counter", pool["hits"]),
+            ("pool_misses_total", "counter", pool["misses"]),
+            ("pool_reconnects_total", "counter", pool["reconnects"]),
+            ("pool_idle", "gauge", pool["idle"]),
+            ("work_queued", "gauge", work["queued"]),
+            ("work_running", "gauge", work["running"]),
+        ]
+
+    def render_prometheus(self, prefix: str = "cekkuota_") -> str:
+        """Format teks eksposisi Prometheus"""
+        def labels_str(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            hists = sorted((k, h.counts[:], h.sum, h.count) for k, h in self.histograms.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} counter")
+            lines.append(f"{prefix}{name}{labels_str(labels)} {value}")
+        for (name, labels), counts, total, count in hists:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} histogram")
+            cum = 0
+            for bound, n in zip(LATENCY_BUCKETS, counts):
+                cum += n
+                lines.append(f"{prefix}{name}_bucket{labels_str(labels, [('le', bound)])} {cum}")
+            lines.append(f"{prefix}{name}_bucket{labels_str(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{prefix}{name}_sum{labels_str(labels)} {total:.6f}")
+            lines.append(f"{prefix}{name}_count{labels_str(labels)} {count}")
+        for name, kind, value in self.collected():
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+            lines.append(f"{prefix}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Semua metrik sebagai dict (untuk dump JSON)"""
+        def key_str(name, labels):
+            return name + "".join(f"[{k}={v}]" for k, v in labels)
+
+        with self._lock:
+            counters = {key_str(*k): v for k, v in sorted(self.counters.items())}
+            hists = {key_str(*k): h.to_dict() for k, h in sorted(self.histograms.items())}
+        return {
+            "time": int(time.time()),
+            "counters": counters,
+            "latency": hists,
+            "collected": {name: value for name, _, value in self.collected()},
+        }
+
+METRICS = Metrics()
+
+def command_label(text: str) -> str:
+    """Nama perintah untuk label metrik (dibatasi agar kardinalitas tetap kecil)"""
+    cmd = (text or "").strip().split(" ", 1)[0].lower().split("@")[0]
+    return cmd if cmd in KNOWN_COMMANDS else "other"
+
+def dump_metrics(path: str = None):
+    """Tulis snapshot metrik ke STATE_DIR (atomic rename)"""
+    path = path or METRICS_FILE
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(METRICS.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        LOG.error(f"[METRICS_DUMP_ERROR] {e}")
+
+def _metrics_dump_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        dump_metrics()
+
+def start_metrics_server(port: int, bind: str = "127.0.0.1"):
+    """Endpoint HTTP lokal: /metrics (Prometheus) dan /metrics.json"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, ctype = METRICS.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif path == "/metrics.json":
+                body, ctype = json.dumps(METRICS.snapshot()).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((bind, port), Handler)
+    except OSError as e:
+        LOG.info(f"[METRICS] Gagal membuka port {bind}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    LOG.info(f"[METRICS] Endpoint aktif di http://{bind}:{port}/metrics")
+    return server
+
+def start_metrics():
+    """Nyalakan endpoint & dump periodik sesuai konfigurasi (mode daemon)"""
+    if METRICS_PORT > 0:
+        start_metrics_server(METRICS_PORT, METRICS_BIND)
+    if METRICS_DUMP_INTERVAL > 0:
+        threading.Thread(target=_metrics_dump_loop, args=(METRICS_DUMP_INTERVAL,),
+                         name="metrics-dump", daemon=True).start()
+
+def fmt_stats() -> str:
+    """Ringkasan metrik untuk perintah /stats"""
+    def fmt_dur(sec):
+        sec = int(sec)
+        d, sec = divmod(sec, 86400)
+        h, sec = divmod(sec, 3600)
+        return (f"{d}h " if d else "") + f"{h}j {sec // 60}m"
+
+    def lat_line(label, hist):
+        if hist is None or not hist.count:
+            return f"{label:<12} -"
+        return (f"{label:<12} n={hist.count} p50={hist.quantile(0.5) * 1000:.0f}ms "
+                f"p99={hist.quantile(0.99) * 1000:.0f}ms")
+
+    collected = {name: value for name, _, value in METRICS.collected()}
+    lines = [
+        lat_line("api_check", METRICS.histogram("api_check_seconds")),
+        lat_line("backend", METRICS.histogram("backend_request_seconds")),
+        lat_line("tg_send", METRICS.histogram("tg_send_seconds")),
+        lat_line("getUpdates", METRICS.histogram("getupdates_seconds")),
+    ]
+    for cmd in KNOWN_COMMANDS + ("other",):
+        hist = METRICS.histogram("command_seconds", command=cmd)
+        if hist is not None:
+            lines.append(lat_line(cmd, hist))
+    lines.append("")
+    lines.append(f"cache        hit={collected['cache_hits_total']} miss={collected['cache_misses_total']} "
+                 f"gabung={collected['cache_coalesced_total']}")
+    lines.append(f"backend      call={collected['backend_calls_total']} retry={collected['backend_retries_total']} "
+                 f"gagal={collected['backend_failures_total']} breaker={'open' if collected['backend_breaker_open'] else 'closed'}")
+    for title, name in (("status API", "backend_responses_total"), ("status TG", "telegram_responses_total")):
+        values = METRICS.counter_values(name)
+        if values:
+            parts = [f"{dict(k).get('status')}={v}" for k, v in sorted(values.items())]
+            lines.append(f"{title:<12} " + " ".join(parts))
+    return (
+        "📊 *STATISTIK BOT*\n\n"
+        f"⏱️ Uptime: *{fmt_dur(collected['uptime_seconds'])}*\n\n"
+        "```\n" + "\n".join(lines) + "\n```"
+    )
+
+# ============= Transport HTTP (pool keep-alive / urllib / fake) =============
+class HttpPool:
+    """Pool koneksi HTTP(S) keep-alive per host, berbasis http.client (stdlib)"""
+
+    # Error yang menandakan koneksi idle sudah diputus server -> sambung ulang
+    _STALE_ERRORS = (
+        http.client.RemoteDisconnected,
+        http.client.CannotSendRequest,
+        http.client.BadStatusLine,
+        BrokenPipeError,
+        ConnectionResetError,
+        ConnectionAbortedError,
+    )
+
+    def __init__(self, idle_timeout: float = 30.0, max_idle: int = 4):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max(1, max_idle)
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_ctx = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reconnects = 0
+
+    def _new_conn(self, key, timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            if self._ssl_ctx is None:
+                self._ssl_ctx = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_ctx)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key, timeout):
+        """Ambil koneksi idle (buang yang kadaluarsa) atau buat baru -> (conn, reused)"""
+        now = time.monotonic()
+        conn = None
+        stale = []
+        with self._lock:
+            idle = self._idle.get(key) or []
+            while idle:
+                c, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(c)
+                    continue
+                conn = c
+                break
+            self.evictions += len(stale)
+            if conn is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for c in stale:
+            c.close()
+
+        if conn is None:
+            return self._new_conn(key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.monotonic()))
+                return
+            self.evictions += 1
+        conn.close()
+
+    def request(self, method: str, url: str, body=None, headers: dict = None, timeout: float = 12):
+        """Kirim request -> (status, headers, raw_bytes); exception jaringan diteruskan ke caller"""
+        parts = parse.urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        hdrs = {"User-Agent": USER_AGENT}
+        hdrs.update(headers or {})
+
+        for attempt in (0, 1):
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, path, body=body, headers=hdrs)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except self._STALE_ERRORS:
+                conn.close()
+                if reused and attempt == 0:
+                    with self._lock:
+                        self.reconnects += 1
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return resp.status, resp.headers, raw
+
+    def stats(self) -> dict:
+        """Counter pool untuk log/monitoring"""
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reconnects": self.reconnects,
+                "idle": idle,
+            }
+
+    def close_all(self):
+        """Tutup semua koneksi idle"""
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c, _ in idle]
+            self._idle.clear()
+        for c in conns:
+            c.close()
+
+class UrllibTransport:
+    """Transport sederhana via urllib (tanpa keep-alive), untuk jaringan/proxy yang bermasalah dengan pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ssl_ctx = None
+        self.requests = 0
+
+    def request(self, method: str, url: str, body=None, headers: dict = None, timeout: float = 12):
+        """Kirim request -> (status, headers, raw_bytes); status >= 400 dikembalikan, bukan exception"""
+        hdrs = {"User-Agent": USER_AGENT}
+        hdrs.update(headers or {})
+        if self._ssl_ctx is None:
+            self._ssl_ctx = ssl.create_default_context()
+        with self._lock:
+            self.requests += 1
+        from urllib import request as urlrequest, error as urlerror
+        req = urlrequest.Request(url, data=body, headers=hdrs, method=method)
+        try:
+            with urlrequest.urlopen(req, timeout=timeout, context=self._ssl_ctx) as resp:
+                return resp.status, resp.headers, resp.read()
+        except urlerror.HTTPError as e:
+            return e.code, e.headers, e.read()
+        except urlerror.URLError as e:
+            # Teruskan error aslinya (timeout, TLS, koneksi) agar klasifikasi retry tetap benar
+            if isinstance(e.reason, Exception):
+                raise e.reason
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": 0, "misses": self.requests, "evictions": 0, "reconnects": 0, "idle": 0}
+
+    def close_all(self):
+        pass
+
+class FakeTransport:
+    """Transport in-memory untuk uji & benchmark: handler dipilih berdasarkan prefix URL.
+    handler(method, url, body, headers) -> (status, payload) atau (status, payload, headers);
+    payload bytes dikirim apa adanya, selain itu di-encode sebagai JSON"""
+
+    def __init__(self, routes=None):
+        self.routes = list(routes or [])
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def route(self, prefix: str, handler):
+        self.routes.append((prefix, handler))
+        return self
+
+    def request(self, method: str, url: str, body=None, headers: dict = None, timeout: float = 12):
+        with self._lock:
+            self.calls.append((method, url, body))
+        for prefix, handler in self.routes:
+            if url.startswith(prefix):
+                result = handler(method, url, body, headers or {})
+                break
+        else:
+            result = (404, {"ok": False, "description": "Not Found"})
+
+        status, payload = result[0], result[1]
+        msg = http.client.HTTPMessage()
+        for k, v in (result[2] if len(result) > 2 else {}).items():
+            msg[k] = v
+        if isinstance(payload, bytes):
+            raw = payload
+        else:
+            raw = json.dumps(payload).encode("utf-8")
+            if "Content-Type" not in msg:
+                msg["Content-Type"] = "application/json"
+        return status, msg, raw
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": len(self.calls), "misses": 0, "evictions": 0, "reconnects": 0, "idle": 0}
+
+    def close_all(self):
+        pass
+
+def make_transport(kind: str):
+    """pool (http.client keep-alive, default) | urllib | fake"""
+    if kind == "urllib":
+        return UrllibTransport()
+    if kind == "fake":
+        return FakeTransport()
+    if kind != "pool":
+        LOG.warning(f"[WARNING] HTTP_TRANSPORT={kind} tidak dikenal, pakai pool")
+    return HttpPool(POOL_IDLE_TIMEOUT, POOL_MAX_IDLE)
+
+TRANSPORT = make_transport(HTTP_TRANSPORT)
+
+def set_transport(transport):
+    """Ganti transport semua panggilan jaringan (backend & Telegram), mis. FakeTransport untuk uji"""
+    global TRANSPORT
+    TRANSPORT = transport
+    return transport
+
+def tg_url(method: str) -> str:
+    """URL method Bot API; base bisa diarahkan ke Bot API server lokal lewat TELEGRAM_API_URL"""
+    return f"{TELEGRAM_API_URL}/bot{current_tenant().token}/{method}"
+
+_TG_URL_RE = re.compile(r"\S*/bot[^/\s]+/(\w+)(?:\?[^\s:]*)?")
+
+def redact_url(text: str) -> str:
+    """Untuk log: URL Bot API (berisi token) diganti nama method-nya saja, mis. tg:getUpdates"""
+    return _TG_URL_RE.sub(r"tg:\1", str(text))
+
+def _decode_json(status: int, headers, raw: bytes):
+    """Decode body JSON; body error (>=400) dicoba walau Content-Type bukan JSON"""
+    ctype = (headers.get("Content-Type", "") if headers is not None else "") or ""
+    if status < 400 and "application/json" not in ctype.lower():
+        return None
+    try:
+        return json.loads(raw.decode("utf-8", "ignore"))
+    except ValueError:
+        return None
 
 def http_post_json(url: str, data: dict, headers: dict):
     """POST JSON dengan error handling lebih baik"""
     try:
         body = json.dumps(data).encode("utf-8")
-        req = request.Request(url, data=body, method="POST")
-        for k, v in headers.items():
-            req.add_header(k, v)
-        
-        with request.urlopen(req, timeout=REQUEST_TIMEOUT) as resp:
-            status = resp.getcode()
-            ctype = resp.headers.get("Content-Type", "")
-            raw = resp.read()
-            if "application/json" in (ctype or "").lower():
-                try:
-                    return status, json.loads(raw.decode("utf-8", "ignore"))
-                except json.JSONDecodeError:
-                    return status, None
-            return status, None
-            
-    except error.HTTPError as e:
-        try:
-            raw = e.read()
-            try:
-                data = json.loads(raw.decode("utf-8", "ignore"))
-            except json.JSONDecodeError:
-                data = None
-        except Exception:
-            raw = b""
-            data = None
-        return e.code, data
-        
-    except (error.URLError, request.socket.timeout, Exception) as e:
-        print(f"[HTTP_POST_ERROR] {url}: {e}")
+        status, hdrs, raw = TRANSPORT.request("POST", url, body, headers, REQUEST_TIMEOUT)
+        return status, _decode_json(status, hdrs, raw)
+    except Exception as e:
+        LOG.error(redact_url(f"[HTTP_POST_ERROR] {url}: {e}"))
         return 0, None
 
 def http_get_json(url: str):
     """GET JSON dengan error handling lebih baik"""
     try:
-        req = request.Request(url, method="GET")
-        with request.urlopen(req, timeout=REQUEST_TIMEOUT + 40) as resp:
-            status = resp.getcode()
-            ctype = resp.headers.get("Content-Type", "")
-            raw = resp.read()
-            if "application/json" in (ctype or "").lower():
-                try:
-                    return status, json.loads(raw.decode("utf-8", "ignore"))
-                except json.JSONDecodeError:
-                    return status, None
-            return status, None
-            
-    except error.HTTPError as e:
-        try:
-            data = json.loads(e.read().decode("utf-8", "ignore"))
-        except Exception:
-            data = None
-        return e.code, data
-        
-    except (error.URLError, Exception) as e:
-        print(f"[HTTP_GET_ERROR] {url}: {e}")
+        status, hdrs, raw = TRANSPORT.request("GET", url, None, None, REQUEST_TIMEOUT + 40)
+        return status, _decode_json(status, hdrs, raw)
+    except Exception as e:
+        LOG.error(redact_url(f"[HTTP_GET_ERROR] {url}: {e}"))
         return 0, None
 
-def tg_send_text(chat_id: str, text: str, parse_mode="Markdown"):
-    """Kirim pesan ke Telegram dengan error handling"""
-    if not BOT_TOKEN:
-        print("[ERROR] BOT_TOKEN kosong - tidak bisa kirim pesan")
-        return False
+def tg_get_updates(url: str):
+    """getUpdates (long polling) dengan pencatatan latensi"""
+    with METRICS.timer("getupdates_seconds"):
+        return http_get_json(url)
+
+def tg_send_message(chat_id: str, text: str, parse_mode="Markdown", reply_markup: dict = None):
+    """Kirim satu pesan (<= 4096 char); kembalikan message_id atau None jika gagal"""
+    payload = {
+        "chat_id": str(chat_id),
+        "text": text
+    }
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    if reply_markup:
+        payload["reply_markup"] = json.dumps(reply_markup)
     
-    if not text or len(str(text)) == 0:
-        print("[WARNING] Pesan kosong")
-        return False
+    with METRICS.timer("tg_send_seconds"):
+        status, data = tg_api("sendMessage", payload)
+    if status == 200:
+        LOG.debug(f"[SEND_OK] chat_id={chat_id}, status={status}")
+        return _get(data, "result", "message_id") or 0
     
-    # Batasi panjang pesan (Telegram limit ~4096 char)
-    if len(text) > 4000:
-        text = text[:3990] + "...\n\n(pesan terpotong)"
+    LOG.error(f"[SEND_ERROR] HTTP {status} - chat_id={chat_id}")
+    if data is not None:
+        LOG.warning(f"[RESPONSE] {data}")
+    return None
+
+def tg_edit_message(chat_id: str, message_id: int, text: str, parse_mode="Markdown",
+                    reply_markup: dict = None) -> bool:
+    """Ganti isi pesan yang sudah terkirim (editMessageText); isi yang sama dianggap sukses"""
+    payload = {
+        "chat_id": str(chat_id),
+        "message_id": int(message_id),
+        "text": text
+    }
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    if reply_markup:
+        payload["reply_markup"] = json.dumps(reply_markup)
     
-    try:
-        api = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {
-            "chat_id": str(chat_id),
-            "text": text
-        }
+    with METRICS.timer("tg_edit_seconds"):
+        status, data = tg_api("editMessageText", payload)
+    if status == 200:
+        return True
+    if status == 400 and "not modified" in str(_get(data, "description") or ""):
+        return True
+    LOG.error(f"[EDIT_ERROR] HTTP {status} - chat_id={chat_id}, message_id={message_id}: {data}")
+    return False
+
+def tg_answer_callback(callback_id: str, text: str = None) -> bool:
+    """answerCallbackQuery: hentikan spinner tombol, opsional dengan teks toast singkat"""
+    params = {"callback_query_id": callback_id}
+    if text:
+        params["text"] = text[:200]
+    status, _ = tg_api("answerCallbackQuery", params)
+    return status == 200
+
+def tg_send_document(chat_id: str, document, filename: str, caption: str = None, parse_mode="Markdown"):
+    """sendDocument: `document` berupa bytes (upload) atau file_id; kembalikan file_id atau None"""
+    params = {"chat_id": str(chat_id)}
+    if caption:
+        params["caption"] = caption[:1024]
         if parse_mode:
-            payload["parse_mode"] = parse_mode
-        
-        data = parse.urlencode(payload).encode("utf-8")
-        req = request.Request(api, data=data, method="POST")
-        req.add_header("Content-Type", "application/x-www-form-urlencoded")
-        
-        with request.urlopen(req, timeout=REQUEST_TIMEOUT) as resp:
-            result = resp.read()
-            status = resp.getcode()
-            print(f"[SEND_OK] chat_id={chat_id}, status={status}")
-            return True
-            
-    except error.HTTPError as e:
-        print(f"[SEND_ERROR] HTTP {e.code} - chat_id={chat_id}: {e.reason}")
-        try:
-            err_data = e.read().decode("utf-8")
-            print(f"[RESPONSE] {err_data}")
-        except:
-            pass
+            params["parse_mode"] = parse_mode
+    files = None
+    if isinstance(document, bytes):
+        ctype = "text/csv" if filename.endswith(".csv") else "application/json"
+        files = {"document": (filename, document, ctype)}
+    else:
+        params["document"] = document
+    
+    with METRICS.timer("tg_send_seconds"):
+        status, data = tg_api("sendDocument", params, files)
+    if status == 200:
+        LOG.debug(f"[SEND_OK] document chat_id={chat_id}, {filename}")
+        return _get(data, "result", "document", "file_id") or ""
+    
+    LOG.error(f"[SEND_ERROR] sendDocument HTTP {status} - chat_id={chat_id}: {data}")
+    return None
+
+def tg_send_text(chat_id: str, text: str, parse_mode="Markdown"):
+    """Kirim pesan ke Telegram; pesan > 4096 char dipecah di batas paket"""
+    if not current_tenant().token:
+        LOG.error("[ERROR] BOT_TOKEN kosong - tidak bisa kirim pesan")
         return False
-    except Exception as e:
-        print(f"[SEND_ERROR] chat_id={chat_id}: {type(e).__name__}: {e}")
+    
+    if not text or len(str(text)) == 0:
+        LOG.warning("[WARNING] Pesan kosong")
         return False
+    
+    ok = True
+    for part in split_message(text):
+        if tg_send_message(chat_id, part, parse_mode) is None:
+            ok = False
+    return ok
 
-def tg_api(method: str, params: dict = None):
-    """Panggil Telegram API"""
+def encode_multipart(fields: dict, files: dict):
+    """multipart/form-data untuk upload file: files = {nama: (filename, bytes, content_type)}"""
+    boundary = "cekkuota" + os.urandom(12).hex()
+    out = []
+    for name, value in fields.items():
+        out.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                   .encode("utf-8"))
+    for name, (filename, content, ctype) in files.items():
+        out.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f"Content-Type: {ctype}\r\n\r\n".encode("utf-8"))
+        out.append(content)
+        out.append(b"\r\n")
+    out.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(out), f"multipart/form-data; boundary={boundary}"
+
+def tg_api(method: str, params: dict = None, files: dict = None):
+    """Panggil Telegram API; throttle per chat, hormati 429 retry_after, backoff untuk 5xx"""
     if params is None:
         params = {}
     
-    try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/{method}"
-        data = parse.urlencode(params).encode("utf-8")
-        req = request.Request(url, data=data, method="POST")
-        req.add_header("Content-Type", "application/x-www-form-urlencoded")
+    chat_id = params.get("chat_id")
+    url = tg_url(method)
+    if files:
+        body, ctype = encode_multipart(params, files)
+        headers = {"Content-Type": ctype}
+    else:
+        body = parse.urlencode(params).encode("utf-8")
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    
+    for attempt in range(TG_RETRIES + 1):
+        limiter = tg_throttle(chat_id)
+        try:
+            status, _, raw = TRANSPORT.request("POST", url, body, headers, REQUEST_TIMEOUT)
+            try:
+                data = json.loads(raw.decode("utf-8", "ignore"))
+            except ValueError:
+                data = None
+        except Exception as e:
+            LOG.error(redact_url(f"[TG_API_ERROR] {method}: {e}"))
+            status, data = 0, None
+        METRICS.inc("telegram_responses_total", status=status)
         
-        with request.urlopen(req, timeout=REQUEST_TIMEOUT) as resp:
-            return resp.getcode(), json.loads(resp.read().decode("utf-8", "ignore"))
-    except Exception as e:
-        print(f"[TG_API_ERROR] {method}: {e}")
-        return 0, None
+        if attempt >= TG_RETRIES:
+            break
+        if status == 429:
+            retry_after = _get(data, "parameters", "retry_after") or 1
+            wait = min(float(retry_after), TG_MAX_RETRY_AFTER)
+            LOG.warning(f"[TG_RATE_LIMIT] {method} chat_id={chat_id}, retry_after={retry_after}")
+            (limiter or current_tenant().tg_limiter).block_for(wait)
+            continue
+        if status == 0 or status >= 500:
+            time.sleep(min(0.5 * (2 ** attempt), 8.0))
+            continue
+        break
+    return status, data
 
-# ============= Format hasil kuota =============
-def _to_list(x):
-    """Convert ke list"""
-    if x is None:
-        return []
-    if isinstance(x, list):
-        return x
-    return [x]
+# ============= Rate limit & pengepakan pesan Telegram =============
+TG_MAX_LEN = 4096
 
-def _get(obj, *keys):
-    """Get nested dict value safely"""
-    cur = obj
-    for k in keys:
-        if isinstance(cur, dict) and k in cur:
-            cur = cur[k]
-        else:
-            return None
-    return cur
+class RateLimiter:
+    """Token bucket thread-safe: `rate` token per detik, kapasitas `burst`"""
 
-def _first_existing(obj, names, default=None):
-    """Get first non-empty value dari list of keys"""
-    if not isinstance(obj, dict):
-        return default
-    
-    for n in names:
-        v = obj.get(n)
-        if v not in (None, "", [], {}):
-            return v
-    return default
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
 
-def extract_quotas(payload: dict):
-    """Extract quota array dari berbagai format response"""
-    if not isinstance(payload, dict):
-        return []
-    
-    # Try: data.quotas
-    q = _get(payload, "data", "quotas")
-    if q is None:
-        # Try: quotas atau quota
-        q = payload.get("quotas") or payload.get("quota") or []
-    
-    return _to_list(q)
+    def acquire(self):
+        """Tunggu sampai ada token"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
 
-def render_quota_details(payload: dict) -> tuple:
-    """Return (header_tuple, monospace_detail_text)"""
+    def try_acquire(self) -> bool:
+        """Ambil token tanpa menunggu; False jika token habis"""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return False
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+    def idle(self, now: float = None) -> bool:
+        """True jika bucket sudah penuh lagi & tidak diblokir (sama saja dengan limiter baru)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if now < self.blocked_until:
+                return False
+            return self.rate <= 0 or self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def block_for(self, seconds: float):
+        """Tahan semua pemakai limiter ini (mis. setelah 429 retry_after)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class LimiterTable:
+    """RateLimiter per kunci (mis. per chat). Limiter yang sudah penuh lagi dibuang paling sering tiap
+    `sweep_every` detik, jadi chat asing (ALLOW_ANY_CHAT) tidak menumpuk di memori selamanya"""
+
+    def __init__(self, rate: float, burst: float, sweep_every: float = 60.0):
+        self.rate = rate
+        self.burst = burst
+        self.sweep_every = sweep_every
+        self._items = {}
+        self._swept = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> RateLimiter:
+        with self._lock:
+            limiter = self._items.get(key)
+            if limiter is None:
+                now = time.monotonic()
+                if now - self._swept >= self.sweep_every:
+                    self._swept = now
+                    for k in [k for k, v in self._items.items() if v.idle(now)]:
+                        del self._items[k]
+                limiter = self._items[key] = RateLimiter(self.rate, self.burst)
+            return limiter
+
+    def __len__(self):
+        return len(self._items)
+
+TG_GLOBAL_LIMITER = RateLimiter(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+_chat_limiters = LimiterTable(TG_CHAT_RATE, TG_CHAT_BURST)
+
+def tg_throttle(chat_id=None):
+    """Ambil jatah kirim (global + per chat); kembalikan limiter chat (atau None)"""
+    t = current_tenant()
+    limiter = None
+    if chat_id is not None:
+        limiter = _chat_limiters.get((t.name, str(chat_id)))
+        limiter.acquire()
+    t.tg_limiter.acquire()
+    return limiter
+
+# Awal satu blok di dalam ``` : paket hasil cek ("┌─ ") atau record riwayat ("[dd-mm-yyyy ")
+_BLOCK_START_RE = re.compile(r"^(?:┌─ |\[\d{2}-\d{2}-\d{4} )")
+
+def split_message(text: str, limit: int = TG_MAX_LEN) -> list:
+    """Pecah pesan panjang di batas paket (di dalam ```) / paragraf (di luar ```); hanya blok yang
+    sendirian melebihi limit dipotong per baris. Blok ``` ditutup & dibuka ulang di tiap potongan"""
+    if len(text) <= limit:
+        return [text]
+    
+    budget = limit - 8  # ruang untuk ``` penutup/pembuka
+    lines = []
+    for line in text.split("\n"):
+        # Baris yang terlalu panjang dipotong paksa
+        while len(line) > budget - 8:
+            lines.append(line[:budget - 8])
+            line = line[budget - 8:]
+        lines.append(line)
+    
+    # Status code block sebelum tiap baris & titik potong yang disukai
+    in_code = []
+    preferred = []
+    code = False
+    for line in lines:
+        in_code.append(code)
+        # Baris kosong di dalam ``` memisahkan benefit dalam satu paket, bukan titik potong
+        preferred.append(bool(_BLOCK_START_RE.match(line)) if code else not line.strip())
+        if line.startswith("```"):
+            code = not code
+    
+    parts = []
+    i, n = 0, len(lines)
+    while i < n:
+        reopen = in_code[i]
+        size = 4 if reopen else 0
+        j = i
+        cut = None
+        while j < n and size + len(lines[j]) + 1 <= budget:
+            if j > i and preferred[j]:
+                cut = j
+            size += len(lines[j]) + 1
+            j += 1
+        end = n if j == n else (cut or j)
+        if end == i:
+            end = i + 1
+        
+        chunk = (["```"] if reopen else []) + lines[i:end]
+        if end < n and in_code[end]:
+            chunk.append("```")
+        part = "\n".join(chunk).strip("\n")
+        if part.replace("```", "").strip():
+            parts.append(part)
+        i = end
+    return parts
+
+class Outbox:
+    """Antrian kirim per chat: beberapa hasil digabung ke sesedikit mungkin pesan (<= 4096 char)"""
+
+    SEPARATOR = "\n\n"
+
+    def __init__(self, parse_mode="Markdown", limit: int = TG_MAX_LEN):
+        self.parse_mode = parse_mode
+        self.limit = limit
+        self._pending = OrderedDict()
+        self.sent = 0
+        self.failed = 0
+
+    def add(self, chat_id, text: str):
+        """Tambah satu blok pesan; kirim paket lama jika sudah penuh"""
+        key = str(chat_id)
+        for part in split_message(text, self.limit):
+            cur = self._pending.get(key)
+            if cur is None:
+                self._pending[key] = part
+            elif len(cur) + len(self.SEPARATOR) + len(part) <= self.limit:
+                self._pending[key] = cur + self.SEPARATOR + part
+            else:
+                self._send(key, cur)
+                self._pending[key] = part
+
+    def flush(self):
+        """Kirim semua pesan yang masih tertahan"""
+        while self._pending:
+            key, text = self._pending.popitem(last=False)
+            self._send(key, text)
+
+    def _send(self, chat_id, text):
+        if not tg_send_text(chat_id, text, self.parse_mode):
+            self.failed += 1
+        self.sent += 1
+
+class ProgressMessage:
+    """Satu pesan status yang diperbarui lewat editMessageText, paling sering tiap `interval` detik"""
+
+    def __init__(self, chat_id, interval: float = 3.0, parse_mode="Markdown"):
+        self.chat_id = str(chat_id)
+        self.interval = interval
+        self.parse_mode = parse_mode
+        self.message_id = None
+        self.edits = 0
+        self._text = None
+        self._last = 0.0
+
+    def start(self, text: str):
+        self.message_id = tg_send_message(self.chat_id, text, self.parse_mode)
+        self._text = text
+        self._last = time.monotonic()
+
+    def update(self, text: str, force: bool = False):
+        """Edit pesan status; dilewati jika belum lewat `interval` atau isinya sama"""
+        if not self.message_id or text == self._text:
+            return
+        if not force and (self.interval <= 0 or time.monotonic() - self._last < self.interval):
+            return
+        if tg_edit_message(self.chat_id, self.message_id, text, self.parse_mode):
+            self.edits += 1
+        self._text = text
+        self._last = time.monotonic()
+
+    def finish(self, text: str):
+        """Teks akhir: edit pesan status, atau kirim pesan baru jika status gagal dikirim/diedit"""
+        if self.message_id and tg_edit_message(self.chat_id, self.message_id, text, self.parse_mode):
+            self.edits += 1
+            return
+        tg_send_text(self.chat_id, text, self.parse_mode)
+
+def fmt_progress(done: int, total: int, failed: int = 0, width: int = 10) -> str:
+    """Status /cek_all: bar sederhana + hitungan"""
+    filled = int(width * done / total) if total else width
+    line = f"⏳ *Sedang cek {total} nomor...*\n`{'▓' * filled}{'░' * (width - filled)}` {done}/{total}"
+    if failed:
+        line += f"\n❌ {failed} gagal"
+    return line
+
+# Tombol inline: callback_data maks. 64 byte, jadi cukup "cek:<628…>" / "nomor"
+CALLBACK_CHECK = "cek:"
+CALLBACK_NUMBERS = "nomor"
+KEYBOARD_MAX_NUMBERS = 90  # Telegram membatasi 100 tombol per pesan
+
+def numbers_keyboard(msisdns) -> dict:
+    """Keyboard daftar nomor pantau, 2 tombol per baris"""
+    buttons = [{"text": f"📱 {m}", "callback_data": CALLBACK_CHECK + m}
+               for m in list(msisdns)[:KEYBOARD_MAX_NUMBERS]]
+    return {"inline_keyboard": [buttons[i:i + 2] for i in range(0, len(buttons), 2)]}
+
+def result_keyboard(msisdn: str) -> dict:
+    """Keyboard di bawah hasil cek: refresh nomor ini & kembali ke daftar nomor"""
+    return {"inline_keyboard": [[
+        {"text": "🔄 Refresh", "callback_data": CALLBACK_CHECK + msisdn},
+        {"text": "📋 Nomor lain", "callback_data": CALLBACK_NUMBERS},
+    ]]}
+
+# ============= Tenant (satu bot = satu tenant) =============
+DEFAULT_TENANT_NAME = "default"
+_TENANT_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class Tenant:
+    """Identitas satu bot: token, chat, nomor pantau, jadwal & file state sendiri.
+    Mode biasa memakai satu tenant dari env; mode multi-tenant memuat banyak dari TENANTS_FILE"""
+    __slots__ = ("name", "token", "chat_ids", "msisdns", "schedules", "allow_any_chat",
+                 "scheduler", "_limiter", "_work")
+
+    def __init__(self, name: str, token: str, chat_ids, msisdns, schedules=None, allow_any_chat: bool = False):
+        self.name = name
+        self.token = token
+        self.chat_ids = list(chat_ids)
+        self.msisdns = msisdns if isinstance(msisdns, MsisdnIndex) else MsisdnIndex(msisdns)
+        self.schedules = list(schedules) if schedules else list(SCHEDULES)
+        self.allow_any_chat = allow_any_chat
+        self.scheduler = None
+        self._limiter = None
+        self._work = None
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        """Entri TENANTS_FILE; kunci sama dengan nama env (bot_token, chat_id, msisdn_list, schedules)"""
+        def as_list(v):
+            if isinstance(v, (list, tuple)):
+                return [str(x).strip() for x in v if str(x).strip()]
+            return [x.strip() for x in str(v or "").split(",") if x.strip()]
+
+        d = {str(k).lower(): v for k, v in d.items()}
+        name = str(d.get("name") or "").strip()
+        if not _TENANT_NAME_RE.match(name) or name == DEFAULT_TENANT_NAME:
+            raise ValueError(f"nama tenant tidak valid: {name!r}")
+        token = str(d.get("bot_token") or "").strip()
+        if not token:
+            raise ValueError(f"tenant {name}: bot_token kosong")
+        return cls(name, token, as_list(d.get("chat_id")), as_list(d.get("msisdn_list")),
+                   as_list(d.get("schedules")), str(d.get("allow_any_chat", "0")) in ("1", "true", "True"))
+
+    def state_path(self, filename: str) -> str:
+        """File state milik tenant; tenant default memakai nama file lama"""
+        if self.name == DEFAULT_TENANT_NAME:
+            return os.path.join(STATE_DIR, filename)
+        root, ext = os.path.splitext(filename)
+        return os.path.join(STATE_DIR, f"{root}.{self.name}{ext}")
+
+    @property
+    def store(self) -> StateStore:
+        """state.json milik tenant (offset & jadwal terakhir)"""
+        return state_store(self.state_path("state.json"))
+
+    @property
+    def history(self) -> "HistoryStore":
+        """history.jsonl milik tenant; daemon dan --cron menulis ke file yang sama"""
+        return history_store(self.state_path("history.jsonl"))
+
+    @property
+    def tg_limiter(self) -> "RateLimiter":
+        """Batas kirim global Telegram berlaku per bot"""
+        if self._limiter is None:
+            self._limiter = RateLimiter(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        return self._limiter
+
+DEFAULT_TENANT = Tenant(DEFAULT_TENANT_NAME, BOT_TOKEN, CHAT_IDS, MSISDN_INDEX, SCHEDULES, ALLOW_ANY_CHAT)
+DEFAULT_TENANT._limiter = TG_GLOBAL_LIMITER
+_tenant_local = threading.local()
+
+def current_tenant() -> Tenant:
+    """Tenant yang sedang dilayani thread ini (default: tenant dari env)"""
+    return getattr(_tenant_local, "tenant", None) or DEFAULT_TENANT
+
+@contextmanager
+def use_tenant(t: Tenant):
+    """Jalankan blok kode atas nama tenant `t` (token, chat, nomor, offset)"""
+    prev = getattr(_tenant_local, "tenant", None)
+    _tenant_local.tenant = t
+    try:
+        yield t
+    finally:
+        _tenant_local.tenant = prev
+
+# ============= Format hasil kuota =============
+def _to_list(x):
+    """Convert ke list"""
+    if x is None:
+        return []
+    if isinstance(x, list):
+        return x
+    return [x]
+
+def _get(obj, *keys):
+    """Get nested dict value safely"""
+    cur = obj
+    for k in keys:
+        if isinstance(cur, dict) and k in cur:
+            cur = cur[k]
+        else:
+            return None
+    return cur
+
+def extract_quotas(payload: dict):
+    """Extract quota array dari berbagai format response"""
     if not isinstance(payload, dict):
+        return []
+    
+    # Try: data.quotas
+    q = _get(payload, "data", "quotas")
+    if q is None:
+        # Try: quotas atau quota
+        q = payload.get("quotas") or payload.get("quota") or []
+    
+    return _to_list(q)
+
+# ============= Model kuota =============
+_AMOUNT_RE = re.compile(r"^\s*([0-9]+(?:[.,][0-9]+)*)\s*([A-Za-z%]*)")
+_UNITS = {
+    "B": (1, "bytes"), "KB": (1024, "bytes"), "MB": (1024 ** 2, "bytes"),
+    "GB": (1024 ** 3, "bytes"), "TB": (1024 ** 4, "bytes"),
+    "KIB": (1024, "bytes"), "MIB": (1024 ** 2, "bytes"), "GIB": (1024 ** 3, "bytes"), "TIB": (1024 ** 4, "bytes"),
+    "K": (1024, "bytes"), "M": (1024 ** 2, "bytes"), "G": (1024 ** 3, "bytes"),
+    "%": (1, "%"),
+    "MENIT": (1, "minutes"), "MNT": (1, "minutes"), "MIN": (1, "minutes"), "MINS": (1, "minutes"),
+    "MINUTES": (1, "minutes"), "DETIK": (1 / 60, "minutes"),
+    "SMS": (1, "sms"),
+}
+_MONTHS = {
+    "JAN": 1, "FEB": 2, "MAR": 3, "APR": 4, "MEI": 5, "MAY": 5, "JUN": 6, "JUL": 7,
+    "AGU": 8, "AGS": 8, "AUG": 8, "SEP": 9, "OKT": 10, "OCT": 10, "NOV": 11, "DES": 12, "DEC": 12,
+}
+_DATE_YMD_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+_DATE_DMY_RE = re.compile(r"(\d{1,2})[-/](\d{1,2})[-/](\d{4})(?:\s+(\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+_DATE_TEXT_RE = re.compile(r"(\d{1,2})\s+([A-Za-z]{3})[A-Za-z]*\s+(\d{4})(?:\s+(\d{1,2})[:.](\d{2})(?:[:.](\d{2}))?)?")
+_EMPTY = (None, "", [], {})
+
+def parse_amount(value):
+    """Parse '1.5 GB' / '750 MB' / '45%' / '100 Menit' / '50 SMS' -> (angka, jenis); None jika tidak dikenal.
+    Jenis: 'bytes', '%', 'minutes', 'sms'"""
+    m = _AMOUNT_RE.match(str(value or ""))
+    if not m:
+        return None
+    num, unit = m.group(1), m.group(2).upper()
+    # "1,5" = desimal, "1,024" / "1.024,5" = pemisah ribuan
+    if "," in num and "." in num:
+        num = num.replace(".", "").replace(",", ".") if num.rfind(",") > num.rfind(".") else num.replace(",", "")
+    elif "," in num:
+        num = num.replace(",", "") if len(num.rsplit(",", 1)[1]) == 3 else num.replace(",", ".")
+    try:
+        n = float(num)
+    except ValueError:
+        return None
+    unit = _UNITS.get(unit)
+    if unit is None:
+        return None
+    return n * unit[0], unit[1]
+
+def parse_expiry(value):
+    """Parse tanggal berlaku ('2025-11-20', '20/11/2025', '20 Nov 2025 23:59') -> epoch lokal; None jika gagal.
+    Tanpa jam dianggap berlaku sampai 23:59:59"""
+    s = str(value or "").strip()
+    m = _DATE_YMD_RE.search(s)
+    if m:
+        y, mo, d = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    else:
+        m = _DATE_DMY_RE.search(s)
+        if m:
+            d, mo, y = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        else:
+            m = _DATE_TEXT_RE.search(s)
+            if not m or m.group(2).upper() not in _MONTHS:
+                return None
+            d, mo, y = int(m.group(1)), _MONTHS[m.group(2).upper()], int(m.group(3))
+    if m.group(4) is not None:
+        hh, mm, ss = int(m.group(4)), int(m.group(5)), int(m.group(6) or 0)
+    else:
+        hh, mm, ss = 23, 59, 59
+    try:
+        return time.mktime((y, mo, d, hh, mm, ss, 0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+def _remaining_percent(remaining_pct: str, used_pct: str, remaining, total):
+    """Persen sisa dari field persen backend, atau dihitung dari sisa/total"""
+    p = parse_amount(remaining_pct)
+    if p is not None and p[1] == "%":
+        return p[0]
+    p = parse_amount(used_pct)
+    if p is not None and p[1] == "%":
+        return 100.0 - p[0]
+    if remaining is not None and total is not None and remaining[1] == total[1] and total[0] > 0:
+        return remaining[0] * 100.0 / total[0]
+    return None
+
+class FieldResolver:
+    """Resolver field untuk satu skema; mengingat varian key yang dipakai backend dan mencobanya duluan"""
+
+    def __init__(self, aliases: dict):
+        self.aliases = aliases
+        self._learned = {}
+
+    def get(self, obj: dict, field: str, default=None):
+        key = self._learned.get(field)
+        if key is not None:
+            v = obj.get(key)
+            if v not in _EMPTY:
+                return v
+        for name in self.aliases[field]:
+            v = obj.get(name)
+            if v not in _EMPTY:
+                self._learned[field] = name
+                return v
+        return default
+
+PACKAGE_FIELDS = FieldResolver({
+    "name": ("name", "package"),
+    "expiry": ("expiry_date", "expired_at", "expire"),
+    "details": ("details", "detail"),
+})
+BENEFIT_FIELDS = FieldResolver({
+    "type": ("type",),
+    "name": ("benefit", "name"),
+    "total": ("total_quota", "total", "quota_total"),
+    "remaining": ("remaining_quota", "remaining", "quota_remaining"),
+    "used_pct": ("used_percentage", "percent_used"),
+    "remaining_pct": ("remaining_percentage", "percent_remaining"),
+})
+
+class Benefit:
+    """Satu benefit (internet/telepon/SMS) dalam paket"""
+    __slots__ = ("name", "type", "total", "remaining", "used_pct", "remaining_pct",
+                 "remaining_amount", "total_amount", "remaining_percent")
+
+    def __init__(self, name, type="", total="-", remaining="-", used_pct="-", remaining_pct="-"):
+        self.name = name
+        self.type = type
+        self.total = total
+        self.remaining = remaining
+        self.used_pct = used_pct
+        self.remaining_pct = remaining_pct
+        self.remaining_amount = parse_amount(remaining)
+        self.total_amount = parse_amount(total)
+        self.remaining_percent = _remaining_percent(remaining_pct, used_pct, self.remaining_amount, self.total_amount)
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        f = BENEFIT_FIELDS
+        typ = str(f.get(d, "type", "")).upper()
+        return cls(
+            str(f.get(d, "name", typ or "Kuota")),
+            typ,
+            str(f.get(d, "total", "-")),
+            str(f.get(d, "remaining", "-")),
+            str(f.get(d, "used_pct", "-")),
+            str(f.get(d, "remaining_pct", "-")),
+        )
+
+    def percent_line(self):
+        """(label, nilai) persentase untuk ditampilkan, atau None"""
+        if "%" in self.remaining_pct:
+            return "Persentase", self.remaining_pct
+        if "%" in self.used_pct:
+            return "Terpakai  ", self.used_pct
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "benefit": self.name, "type": self.type,
+            "total_quota": self.total, "remaining_quota": self.remaining,
+            "used_percentage": self.used_pct, "remaining_percentage": self.remaining_pct,
+        }
+
+class Package:
+    """Satu paket kuota beserta benefit-nya"""
+    __slots__ = ("name", "expiry", "benefits", "expiry_ts")
+
+    def __init__(self, name, expiry="-", benefits=None):
+        self.name = name
+        self.expiry = expiry
+        self.benefits = benefits or []
+        self.expiry_ts = parse_expiry(expiry)
+
+    @classmethod
+    def from_dict(cls, pkg: dict):
+        f = PACKAGE_FIELDS
+        details = f.get(pkg, "details", [])
+        benefits = [Benefit.from_dict(d) for d in details if isinstance(d, dict)] if isinstance(details, list) else []
+        return cls(str(f.get(pkg, "name", "Paket")), str(f.get(pkg, "expiry", "-")), benefits)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "expiry_date": self.expiry, "details": [b.to_dict() for b in self.benefits]}
+
+class QuotaReport:
+    """Hasil cek kuota yang sudah di-parse sekali dari payload backend"""
+    __slots__ = ("packages", "error")
+
+    def __init__(self, packages=None, error=None):
+        self.packages = packages or []
+        self.error = error
+
+    @classmethod
+    def from_payload(cls, payload):
+        """Parse payload JSON backend; None jika payload bukan dict"""
+        if isinstance(payload, QuotaReport):
+            return payload
+        if not isinstance(payload, dict):
+            return None
+        if "error" in payload:
+            return cls(error=str(payload.get("error", "Terjadi kesalahan")))
+        return cls([Package.from_dict(p) for p in extract_quotas(payload) if isinstance(p, dict)])
+
+    def to_dict(self) -> dict:
+        """Bentuk JSON kanonik (bisa di-parse ulang oleh from_payload)"""
+        if self.error is not None:
+            return {"error": self.error}
+        return {"quotas": [p.to_dict() for p in self.packages]}
+
+    def snapshot(self) -> list:
+        """Ringkasan untuk riwayat: [[paket, berlaku, [[benefit, sisa, total], ...]], ...]"""
+        return [[p.name, p.expiry, [[b.name, b.remaining, b.total] for b in p.benefits]] for p in self.packages]
+
+    def only(self, names) -> "QuotaReport":
+        """Report baru berisi paket dengan nama tertentu saja"""
+        return QuotaReport([p for p in self.packages if p.name in names], self.error)
+
+# ============= Format hasil kuota =============
+def render_quota_details(payload) -> tuple:
+    """Return (header_tuple, monospace_detail_text)"""
+    report = QuotaReport.from_payload(payload)
+    if report is None:
         return ("📡 Hasil Cek Kuota", "Tidak ada data"), ""
 
-    if "error" in payload:
-        error_msg = str(payload.get("error", "Terjadi kesalahan"))
-        return ("❌ Error", error_msg), ""
+    if report.error is not None:
+        return ("❌ Error", report.error), ""
 
-    quotas = extract_quotas(payload)
-    if not quotas:
+    if not report.packages:
         return ("✅ Cek Berhasil", "Tidak ada data kuota"), ""
     
     try:
         detail_lines = []
         
-        for pkg_idx, pkg in enumerate(quotas[:12], 1):
-            if not isinstance(pkg, dict):
+        for pkg_idx, pkg in enumerate(report.packages[:12], 1):
+            detail_lines.append("")
+            detail_lines.append(f"┌─ PAKET {pkg_idx}: {pkg.name}")
+            detail_lines.append(f"└─ Berlaku sampai: {pkg.expiry}")
+            detail_lines.append("")
+            
+            if pkg.benefits:
+                for b in pkg.benefits:
+                    detail_lines.append(f"  • {b.name}")
+                    detail_lines.append(f"    Sisa      : {b.remaining}")
+                    detail_lines.append(f"    Total     : {b.total}")
+                    
+                    pct = b.percent_line()
+                    if pct:
+                        detail_lines.append(f"    {pct[0]} : {pct[1]}")
+                    detail_lines.append("")
+            else:
+                detail_lines.append("  ℹ️  Tidak ada detail")
+                detail_lines.append("")
+        
+        detail_text = "\n".join(detail_lines).strip()
+        header = ("📊 Cek Kuota Berhasil", "Lihat detail di bawah")
+        return header, detail_text
+        
+    except Exception as e:
+        LOG.error(f"[RENDER_ERROR] {e}")
+        return ("⚠️ Parsing Error", str(e)), ""
+
+def fmt_result(msisdn: str, status: int, data, note: str = None):
+    """Format hasil cek kuota (QuotaReport / payload dict) untuk dikirim ke Telegram"""
+    try:
+        (header_title, header_sub), detail = render_quota_details(data or {})
+        if note and detail:
+            header_sub = note
+        
+        if status == 200:
+            result = f"*{header_title}*\n_{header_sub}_\n\n📱 Nomor: `{msisdn}`"
+        else:
+            result = f"*❌ Gagal Cek Kuota*\nStatus: `{status}`\n📱 Nomor: `{msisdn}`"
+            if header_title == "❌ Error":
+                result += f"\nKeterangan: `{header_sub.replace('`', '')}`"
+        
+        if detail:
+            result += f"\n\n```\n{detail}\n```"
+        
+        return result
+        
+    except Exception as e:
+        LOG.error(f"[FMT_RESULT_ERROR] {e}")
+        return f"*❌ Error*\nNomor: `{msisdn}`\nError: {str(e)}"
+
+# ============= Peringatan kuota menipis =============
+_NAN = float("nan")
+
+class AlertEvaluator:
+    """Kumpulkan semua benefit dari satu run ke array kolom, lalu evaluasi ambang sekali jalan"""
+
+    def __init__(self, min_bytes: float = 0, min_percent: float = 0, expiry_days: float = 0):
+        self.min_bytes = min_bytes
+        self.min_percent = min_percent
+        self.expiry_days = expiry_days
+        # Satu baris per benefit (paket tanpa benefit tetap 1 baris untuk cek masa berlaku)
+        self.rows = []
+        self.remaining = array("d")
+        self.percent = array("d")
+        self.expiry = array("d")
+
+    @classmethod
+    def from_config(cls):
+        """Evaluator dari ENV, None jika peringatan dimatikan"""
+        if not ALERT_ENABLED:
+            return None
+        return cls(ALERT_MIN_MB * 1024 ** 2, ALERT_MIN_PERCENT, ALERT_EXPIRY_DAYS)
+
+    def add(self, msisdn: str, report: QuotaReport):
+        """Masukkan hasil cek sukses satu nomor"""
+        if report is None or report.error is not None:
+            return
+        for pkg in report.packages:
+            exp = pkg.expiry_ts if pkg.expiry_ts is not None else _NAN
+            for b in pkg.benefits or (None,):
+                self.rows.append((msisdn, pkg, b))
+                amount = b.remaining_amount if b is not None else None
+                pct = b.remaining_percent if b is not None else None
+                self.remaining.append(amount[0] if amount is not None and amount[1] == "bytes" else _NAN)
+                self.percent.append(pct if pct is not None else _NAN)
+                self.expiry.append(exp)
+
+    def evaluate(self, now: float = None) -> dict:
+        """{msisdn: [baris peringatan, ...]} untuk nomor yang melewati ambang"""
+        now = now or time.time()
+        min_bytes, min_percent = self.min_bytes, self.min_percent
+        expiry_limit = now + self.expiry_days * 86400 if self.expiry_days > 0 else _NAN
+        alerts = OrderedDict()
+        expiry_seen = set()
+
+        # NaN tidak pernah lolos perbandingan, jadi kolom kosong otomatis terlewati
+        for row, rem, pct, exp in zip(self.rows, self.remaining, self.percent, self.expiry):
+            msisdn, pkg, b = row
+            low = (min_bytes > 0 and rem < min_bytes) or (min_percent > 0 and pct < min_percent)
+            if low:
+                pct_text = f" ({pct:.0f}%)" if pct == pct else ""
+                alerts.setdefault(msisdn, []).append(f"🔻 {b.name}: {b.remaining}{pct_text} — {pkg.name}")
+            if exp <= expiry_limit and (msisdn, pkg.name) not in expiry_seen:
+                expiry_seen.add((msisdn, pkg.name))
+                days = max(0.0, (exp - now) / 86400)
+                when = "sudah habis" if exp < now else f"habis {days:.0f} hari lagi" if days >= 1 else "habis hari ini"
+                alerts.setdefault(msisdn, []).append(f"⏳ {pkg.name}: {when} ({pkg.expiry})")
+        return alerts
+
+    def render(self, now: float = None):
+        """Pesan peringatan ringkas, None jika semua aman"""
+        alerts = self.evaluate(now)
+        if not alerts:
+            return None
+        lines = []
+        for msisdn, items in alerts.items():
+            lines.append(f"📱 {msisdn}")
+            lines.extend(f"  {x}" for x in items)
+            lines.append("")
+        detail = "\n".join(lines).strip()
+        return f"🚨 *PERINGATAN KUOTA* ({len(alerts)} nomor)\n\n```\n{detail}\n```"
+
+# ============= Cache hasil cek kuota =============
+CACHE_FILE = os.path.join(STATE_DIR, "quota_cache.json")  # format lama, hanya dibaca untuk migrasi
+
+class _Flight:
+    """Satu request backend yang sedang berjalan (single-flight)"""
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = (0, None)
+
+class QuotaCache:
+    """Cache TTL + LRU untuk hasil cek kuota, request bersamaan untuk nomor yang sama digabung"""
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 512):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_locked(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1], entry[2]
+
+    def _put_locked(self, key, status, data, stored_at=None):
+        self._data[key] = (stored_at or time.time(), status, data)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+        self._dirty = True
+
+    def get(self, key):
+        """Ambil (status, data) yang masih segar, atau None"""
+        with self._lock:
+            return self._get_locked(key)
+
+    def put(self, key, status, data):
+        with self._lock:
+            self._put_locked(key, status, data)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._dirty = True
+
+    def get_or_fetch(self, key, fetch, fresh: bool = False):
+        """Kembalikan hasil cache; jika tidak ada, panggil fetch() sekali untuk semua pemanggil bersamaan"""
+        if self.ttl <= 0:
+            return fetch()
+
+        with self._lock:
+            if not fresh:
+                cached = self._get_locked(key)
+                if cached is not None:
+                    self.hits += 1
+                    return cached
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            flight.event.wait()
+            return flight.result
+
+        try:
+            flight.result = fetch()
+        finally:
+            status, data = flight.result
+            with self._lock:
+                self._inflight.pop(key, None)
+                # Hanya hasil sukses yang di-cache
+                if status == 200:
+                    self._put_locked(key, status, data)
+            flight.event.set()
+        return flight.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+    def load_snapshot(self, snap: dict):
+        """Muat entri yang belum kadaluarsa dari snapshot"""
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, entry in (snap.get("entries") or {}).items():
+                try:
+                    stored_at, status, data = entry
+                except (TypeError, ValueError):
+                    continue
+                if now - stored_at <= self.ttl and key not in self._data:
+                    self._put_locked(key, status, QuotaReport.from_payload(data), stored_at)
+                    loaded += 1
+            self._dirty = False
+        return loaded
+
+    def snapshot(self):
+        """Entri yang masih segar untuk disimpan, None jika tidak ada perubahan sejak snapshot terakhir"""
+        with self._lock:
+            if not self._dirty:
+                return None
+            now = time.time()
+            entries = {k: [t, status, report.to_dict() if report is not None else None]
+                       for k, (t, status, report) in self._data.items() if now - t <= self.ttl}
+            self._dirty = False
+        return {"entries": entries}
+
+QUOTA_CACHE = QuotaCache(CACHE_TTL, CACHE_MAX)
+
+def load_cache_snapshot():
+    """Muat snapshot cache dari state.json (jika CACHE_SNAPSHOT=1)"""
+    if not CACHE_SNAPSHOT:
+        return
+    snap = state_store().get("cache")
+    if snap is None:
+        legacy = read_legacy_state(CACHE_FILE)
+        try:
+            snap = json.loads(legacy) if legacy else None
+        except ValueError as e:
+            LOG.error(f"[CACHE_LOAD_ERROR] {e}")
+    n = QUOTA_CACHE.load_snapshot(snap) if isinstance(snap, dict) else 0
+    if n:
+        LOG.info(f"[CACHE] {n} hasil dimuat dari snapshot")
+
+def save_cache_snapshot():
+    """Simpan snapshot cache ke state.json (jika CACHE_SNAPSHOT=1); ditulis ke disk saat flush"""
+    if CACHE_SNAPSHOT:
+        snap = QUOTA_CACHE.snapshot()
+        if snap is not None:
+            state_store().set("cache", snap)
+
+# ============= Riwayat kuota =============
+HISTORY_FILE = os.path.join(STATE_DIR, "history.jsonl")
+
+def _remaining_changed(old: str, new: Benefit) -> bool:
+    """True jika sisa kuota berubah melewati ambang DELTA_MIN_MB (data) / DELTA_MIN_PERCENT (%);
+    satuan lain (menit, SMS) dianggap berubah pada selisih berapa pun"""
+    if old == new.remaining:
+        return False
+    a, b = parse_amount(old), new.remaining_amount
+    if a is None or b is None or a[1] != b[1]:
+        return True
+    if a[1] == "bytes":
+        return abs(a[0] - b[0]) >= DELTA_MIN_MB * 1024 ** 2
+    if a[1] == "%":
+        return abs(a[0] - b[0]) >= DELTA_MIN_PERCENT
+    return a[0] != b[0]
+
+def changed_packages(prev: list, report: QuotaReport) -> set:
+    """Nama paket di `report` yang baru / berubah dibanding snapshot riwayat `prev`"""
+    if prev is None:
+        return {p.name for p in report.packages}
+    old = {p[0]: p for p in prev}
+    changed = set()
+    for pkg in report.packages:
+        before = old.get(pkg.name)
+        if before is None or before[1] != pkg.expiry:
+            changed.add(pkg.name)
+            continue
+        old_remaining = {b[0]: b[1] for b in before[2]}
+        for b in pkg.benefits:
+            if b.name not in old_remaining or _remaining_changed(old_remaining[b.name], b):
+                changed.add(pkg.name)
+                break
+    return changed
+
+class HistoryStore:
+    """Riwayat kuota append-only (JSONL) dengan indeks offset per MSISDN di memori.
+    File juga ditulis proses lain (daemon & --cron), jadi indeks disinkronkan tiap kali dipakai"""
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024, keep: int = 50):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = max(1, keep)
+        self._index = {}
+        self._last = {}
+        self._size = 0
+        self._ident = None
+        self._lock = threading.Lock()
+
+    def _reset_locked(self, ident=None):
+        self._index.clear()
+        self._last.clear()
+        self._size = 0
+        self._ident = ident
+
+    def _sync_locked(self, f):
+        """Samakan indeks dengan file yang sedang dibuka: record baru (mis. dari cron) dibaca mulai
+        offset terakhir; file yang diganti (dipadatkan proses lain) atau menyusut dibaca ulang penuh"""
+        st = os.fstat(f.fileno())
+        ident = (st.st_dev, st.st_ino)
+        if ident != self._ident or st.st_size < self._size:
+            self._reset_locked(ident)
+        if st.st_size == self._size:
+            return
+        f.seek(self._size)
+        while True:
+            pos = f.tell()
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break  # akhir file, atau baris yang masih ditulis proses lain
+            self._size = pos + len(line)
+            try:
+                rec = json.loads(line)
+                msisdn, ts = rec["m"], rec["t"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            self._index.setdefault(msisdn, []).append((ts, pos))
+            self._last[msisdn] = rec.get("p")
+
+    def append(self, msisdn: str, snapshot: list, ts: float = None) -> bool:
+        """Tambah record; dilewati jika isinya sama dengan record terakhir nomor itu"""
+        with self._lock:
+            rec = {"t": int(ts or time.time()), "m": msisdn, "p": snapshot}
+            line = (json.dumps(rec, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+            try:
+                with open(self.path, "a+b") as f:
+                    self._sync_locked(f)
+                    if self._last.get(msisdn) == snapshot:
+                        return False
+                    f.write(line)
+                    f.flush()
+                    # Offset dibaca balik dari file: proses lain bisa saja menambah baris di antaranya
+                    self._sync_locked(f)
+            except Exception as e:
+                LOG.error(f"[HISTORY_WRITE_ERROR] {e}")
+                return False
+            if self._size > self.max_bytes:
+                self._compact_locked()
+            return True
+
+    def records(self, msisdn: str, limit: int = None, before: float = None) -> list:
+        """Record untuk satu nomor (lama -> baru), opsional hanya yang lebih tua dari `before`"""
+        with self._lock:
+            out = []
+            try:
+                with open(self.path, "rb") as f:
+                    self._sync_locked(f)
+                    entries = self._index.get(msisdn) or []
+                    if before is not None:
+                        entries = [e for e in entries if e[0] < before]
+                    if limit:
+                        entries = entries[-limit:]
+                    for _ts, pos in entries:
+                        f.seek(pos)
+                        out.append(json.loads(f.readline()))
+            except FileNotFoundError:
+                self._reset_locked()
+            except Exception as e:
+                LOG.error(f"[HISTORY_READ_ERROR] {e}")
+            return out
+
+    def last(self, msisdn: str, before: float = None):
+        """Snapshot terakhir (opsional sebelum waktu tertentu), None jika belum ada"""
+        recs = self.records(msisdn, limit=1, before=before)
+        return recs[0]["p"] if recs else None
+
+    def _compact_locked(self):
+        """Tulis ulang file: simpan `keep` record terakhir per nomor"""
+        keep = []
+        try:
+            with open(self.path, "rb") as f:
+                self._sync_locked(f)
+                for entries in self._index.values():
+                    for _ts, pos in entries[-self.keep:]:
+                        f.seek(pos)
+                        keep.append(f.readline())
+            keep.sort(key=lambda line: json.loads(line)["t"])
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.writelines(keep)
+            os.replace(tmp, self.path)
+            LOG.info(f"[HISTORY] Dipadatkan: {len(keep)} record")
+        except Exception as e:
+            LOG.error(f"[HISTORY_COMPACT_ERROR] {e}")
+        # File baru (inode lain): indeks dibangun ulang saat dipakai berikutnya
+        self._reset_locked()
+
+_HISTORY_STORES = {}
+_HISTORY_LOCK = threading.Lock()
+
+def history_store(path: str = None) -> HistoryStore:
+    """HistoryStore untuk `path` (default HISTORY_FILE), satu objek per file dalam proses ini"""
+    path = path or HISTORY_FILE
+    with _HISTORY_LOCK:
+        store = _HISTORY_STORES.get(path)
+        if store is None:
+            store = _HISTORY_STORES[path] = HistoryStore(path, HISTORY_MAX_KB * 1024, HISTORY_KEEP)
+        return store
+
+def record_history(msisdn: str, report: QuotaReport):
+    """Simpan hasil cek sukses ke riwayat (jika HISTORY_ENABLED)"""
+    if not HISTORY_ENABLED or report is None or report.error is not None:
+        return
+    try:
+        current_tenant().history.append(msisdn, report.snapshot())
+    except Exception as e:
+        LOG.error(f"[HISTORY_ERROR] {msisdn}: {e}")
+
+def fmt_history(msisdn: str, limit: int = 5) -> str:
+    """Format riwayat kuota satu nomor dari disk (tanpa request ke backend)"""
+    recs = current_tenant().history.records(msisdn, limit=limit)
+    if not recs:
+        return f"🗂️ *Riwayat Kuota*\n📱 Nomor: `{msisdn}`\n\n_Belum ada riwayat_"
+    
+    lines = []
+    for rec in reversed(recs):
+        lines.append(f"[{time.strftime('%d-%m-%Y %H:%M', time.localtime(rec['t']))}]")
+        for name, exp, benefits in rec.get("p") or []:
+            lines.append(f"┌─ {name} (s/d {exp})")
+            for benefit, remain, total in benefits:
+                lines.append(f"│  • {benefit}: {remain} / {total}")
+        lines.append("")
+    
+    detail = "\n".join(lines).strip()
+    return (
+        f"🗂️ *Riwayat Kuota* ({len(recs)} terakhir)\n📱 Nomor: `{msisdn}`"
+        f"\n\n```\n{detail}\n```"
+    )
+
+# ============= Ketahanan backend (retry, circuit breaker, budget) =============
+RETRYABLE_STATUSES = {0, 408, 425, 429, 500, 502, 503, 504}
+
+class Deadline:
+    """Batas waktu total untuk satu run (cron / cek_all); None/0 = tanpa batas"""
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + seconds if seconds and seconds > 0 else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class CircuitBreaker:
+    """Circuit breaker berdasarkan rasio gagal di N panggilan terakhir"""
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: int = 20, min_calls: int = 10, error_rate: float = 0.5, cooldown: float = 30.0):
+        self.outcomes = deque(maxlen=max(1, window))
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Boleh panggil backend? Saat terbuka ditolak sampai cooldown, lalu 1 panggilan uji"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                    LOG.info("[BREAKER] Backend pulih, circuit ditutup")
+                else:
+                    self._open_locked()
+                return
+            self.outcomes.append(ok)
+            n = len(self.outcomes)
+            if self.state == self.CLOSED and n >= self.min_calls:
+                if self.outcomes.count(False) / n >= self.error_rate:
+                    self._open_locked()
+
+    def _open_locked(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        LOG.warning(f"[BREAKER] Backend gagal terus, circuit dibuka {self.cooldown:.0f} detik")
+
+BACKEND_BREAKER = CircuitBreaker(CB_WINDOW, CB_MIN_CALLS, CB_ERROR_RATE, CB_COOLDOWN)
+BACKEND_STATS = {"calls": 0, "retries": 0, "failures": 0}
+_backend_stats_lock = threading.Lock()
+
+def _count(stats: dict, key: str, n: int = 1):
+    with _backend_stats_lock:
+        stats[key] = stats.get(key, 0) + n
+
+def is_retryable_error(e: Exception) -> bool:
+    """Error jaringan sementara boleh di-retry; error sertifikat/protokol tidak"""
+    if isinstance(e, (ssl.SSLCertVerificationError, ValueError)):
+        return False
+    return isinstance(e, (TimeoutError, ConnectionError, http.client.HTTPException, OSError))
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """Exponential backoff + full jitter; Retry-After dari server (jika ada) diutamakan"""
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    cap = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(cap / 2, cap)
+
+def _retry_after(headers):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def backend_stats() -> dict:
+    with _backend_stats_lock:
+        stats = dict(BACKEND_STATS)
+    stats["breaker"] = BACKEND_BREAKER.state
+    stats["rejected"] = BACKEND_BREAKER.rejected
+    return stats
+
+# ============= Panggil API cek kuota =============
+def api_check(msisdn: str, fresh: bool = False, deadline: Deadline = None):
+    """Cek kuota (lewat cache) -> (status, QuotaReport|None); fresh=True memaksa request baru ke backend"""
+    msisdn = normalize_msisdn(msisdn) or msisdn
+    with METRICS.timer("api_check_seconds"):
+        return QUOTA_CACHE.get_or_fetch(msisdn, lambda: _api_fetch(msisdn, deadline), fresh)
+
+def _api_fetch(msisdn: str, deadline: Deadline = None):
+    """Cek kuota langsung ke API backend (retry + backoff, circuit breaker, budget waktu)"""
+    try:
+        headers = {
+            "Content-Type": "application/json",
+            "X-FDZ-Key": EDGE_HEADER_KEY,
+            "User-Agent": USER_AGENT
+        }
+        body = json.dumps({"msisdn": msisdn}).encode("utf-8")
+        deadline = deadline or Deadline()
+        attempt = 0
+        
+        while True:
+            if deadline.remaining() < 1.0:
+                LOG.warning(f"[BUDGET] Waktu run habis, {msisdn} dilewati")
+                return 0, QuotaReport(error="Batas waktu run habis, nomor dilewati")
+            if not BACKEND_BREAKER.allow():
+                return 0, QuotaReport(error="Backend sedang gangguan, coba lagi nanti")
+            
+            timeout = min(REQUEST_TIMEOUT, deadline.remaining())
+            retry_after = None
+            _count(BACKEND_STATS, "calls")
+            t0 = time.perf_counter()
+            try:
+                with host_slot(API_URL):
+                    status, hdrs, raw = TRANSPORT.request("POST", API_URL, body, headers, timeout)
+                data = _decode_json(status, hdrs, raw)
+                retryable = status in RETRYABLE_STATUSES
+                if status in (429, 503):
+                    retry_after = _retry_after(hdrs)
+            except Exception as e:
+                LOG.error(f"[HTTP_POST_ERROR] {API_URL}: {type(e).__name__}: {e}")
+                status, data = 0, None
+                retryable = is_retryable_error(e)
+            METRICS.observe("backend_request_seconds", time.perf_counter() - t0)
+            METRICS.inc("backend_responses_total", status=status)
+            
+            ok = status != 0 and status not in RETRYABLE_STATUSES
+            BACKEND_BREAKER.record(ok)
+            if not ok:
+                _count(BACKEND_STATS, "failures")
+            if not retryable or attempt >= RETRIES:
+                break
+            
+            delay = backoff_delay(attempt, retry_after)
+            if delay + 1.0 >= deadline.remaining():
+                break
+            attempt += 1
+            _count(BACKEND_STATS, "retries")
+            LOG.warning(f"[RETRY] {msisdn} status={status}, percobaan {attempt}/{RETRIES} dalam {delay:.2f}s")
+            time.sleep(delay)
+        
+        report = QuotaReport.from_payload(data)
+        if status == 200:
+            record_history(msisdn, report)
+        return status, report
+        
+    except Exception as e:
+        LOG.error(f"[API_CHECK_ERROR] {msisdn}: {e}")
+        return 0, None
+
+# ============= Engine cek paralel =============
+_host_sems = {}
+_host_sems_lock = threading.Lock()
+
+def host_slot(url: str):
+    """Semaphore per host, membatasi request paralel ke host yang sama"""
+    host = parse.urlsplit(url).netloc
+    with _host_sems_lock:
+        sem = _host_sems.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(max(1, HOST_CONCURRENCY))
+            _host_sems[host] = sem
+    return sem
+
+def _check_one(msisdn: str, deadline: Deadline = None):
+    """Cek satu nomor untuk engine"""
+    status, report = api_check(msisdn, deadline=deadline)
+    return msisdn, status, report
+
+def check_many(msisdns, workers: int = None, deadline: Deadline = None):
+    """Cek banyak nomor secara paralel (bounded), yield (msisdn, status, report) sesuai urutan input"""
+    items = iter(msisdns)
+    workers = max(1, workers or CHECK_WORKERS)
+    if workers == 1:
+        for msisdn in items:
+            yield _check_one(msisdn, deadline)
+        return
+
+    # Jendela geser: paling banyak 2x worker yang antre, hasil keluar urut
+    from concurrent.futures import ThreadPoolExecutor
+    window = deque()
+    tenant = current_tenant()
+
+    def check(msisdn):
+        # Thread pool tidak mewarisi tenant pemanggil (riwayat ditulis ke file tenant)
+        with use_tenant(tenant):
+            return _check_one(msisdn, deadline)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cek") as ex:
+        for msisdn in items:
+            window.append(ex.submit(check, msisdn))
+            if len(window) >= workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+# ============= Mode CRON =============
+def cron_run():
+    """Jalankan cek kuota untuk semua nomor (gunakan dengan cron); --report = kirim sebagai dokumen"""
+    missing = []
+    if not TENANTS_FILE:  # multi-tenant: tiap tenant divalidasi di tenants_cron_run
+        if not BOT_TOKEN:
+            missing.append("BOT_TOKEN")
+        if not CHAT_IDS:
+            missing.append("CHAT_ID")
+        if not MSISDN_INDEX:
+            missing.append("MSISDN_LIST")
+    
+    if missing:
+        LOG.error(f"[ERROR] ENV kurang: {', '.join(missing)}")
+        return
+
+    report = "--report" in sys.argv
+    if BUILTIN_SCHEDULER and not report and "--force" not in sys.argv:
+        LOG.info("[CRON] SCHEDULER_MODE=builtin: cek dijadwalkan oleh daemon, run cron dilewati (pakai --force untuk paksa)")
+        return
+
+    init_state()
+    load_cache_snapshot()
+    if TENANTS_FILE:
+        tenants_cron_run(report)
+    elif report:
+        run_report_pipeline("REPORT", fmt=REPORT_FORMAT)
+    else:
+        run_check_pipeline("CRON")
+    if METRICS_DUMP_INTERVAL > 0:
+        dump_metrics()
+
+def run_check_pipeline(tag: str = "CRON"):
+    """Cek semua nomor pantau lalu kirim hasil/peringatan ke semua CHAT_ID (tenant aktif)"""
+    t = current_tenant()
+    LOG.info(f"[{tag}] Cek kuota untuk {len(t.msisdns)} nomor...")
+    
+    delta = CRON_DELTA or "--delta" in sys.argv
+    # Record riwayat dari run ini bertimestamp >= run_started
+    run_started = int(time.time())
+    unchanged = 0
+    baselines = (t.store.get("delta_baseline") or {}) if delta else {}
+    notified = {}
+    
+    alerts = AlertEvaluator.from_config()
+    outbox = Outbox("Markdown")
+    for msisdn, status, report in check_many(t.msisdns, deadline=Deadline(RUN_BUDGET)):
+        if alerts is not None and status == 200:
+            alerts.add(msisdn, report)
+        if delta and status == 200 and report is not None:
+            report, baseline = delta_report(msisdn, report, baselines.get(msisdn), run_started)
+            if report is None:
+                unchanged += 1
+                continue
+            if baseline is not None:
+                notified[msisdn] = baseline
+            msg = fmt_result(msisdn, status, report, note="Perubahan sejak laporan terakhir")
+        else:
+            msg = fmt_result(msisdn, status, report)
+        
+        for cid in t.chat_ids:
+            outbox.add(cid, msg)
+    
+    if unchanged:
+        for cid in t.chat_ids:
+            outbox.add(cid, f"😴 _{unchanged} nomor tanpa perubahan kuota sejak laporan terakhir_")
+    alert_msg = alerts.render() if alerts is not None else None
+    if alert_msg:
+        for cid in t.chat_ids:
+            outbox.add(cid, alert_msg)
+    outbox.flush()
+    if notified:
+        # Baseline hanya maju jika semua pesan terkirim; gagal kirim = dilaporkan lagi di run berikutnya
+        if outbox.failed:
+            LOG.warning(f"[DELTA] {outbox.failed} pesan gagal terkirim, baseline delta tidak diperbarui")
+        else:
+            baselines = dict(t.store.get("delta_baseline") or {})
+            baselines.update(notified)
+            t.store.set("delta_baseline", baselines, durable=True)
+    
+    save_cache_snapshot()
+    LOG.info(f"[SEND] {outbox.sent} pesan")
+    LOG.info(f"[POOL] {TRANSPORT.stats()}")
+    LOG.info(f"[CACHE] {QUOTA_CACHE.stats()}")
+    LOG.info(f"[BACKEND] {backend_stats()}")
+    LOG.info(f"[{tag}] Selesai!")
+
+def delta_report(msisdn: str, report: QuotaReport, baseline: list, before: float):
+    """(report berisi paket yang berubah sejak terakhir DIKIRIM, baseline baru); report None jika tidak
+    ada perubahan. `baseline` = snapshot yang terakhir dilaporkan; tanpa baseline (run pertama setelah
+    upgrade) dibandingkan dengan record riwayat sebelum `before`.
+    Baseline baru hanya memajukan paket yang dilaporkan, jadi pemakaian pelan tetap terkumpul"""
+    if report.error is not None:
+        return report, None
+    if baseline is None and HISTORY_ENABLED:
+        baseline = current_tenant().history.last(msisdn, before=before)
+    names = changed_packages(baseline, report)
+    if not names:
+        return None, baseline
+    old = {p[0]: p for p in baseline or []}
+    current = report.snapshot()
+    merged = [pkg if pkg[0] in names or pkg[0] not in old else old[pkg[0]] for pkg in current]
+    return report.only(names), merged
+
+# ============= Laporan (CSV / JSON) =============
+REPORT_FIELDS = ("msisdn", "status", "paket", "masa_aktif", "benefit", "tipe", "sisa", "total", "sisa_persen", "error")
+REPORT_FORMATS = ("csv", "json")
+
+def iter_report_rows(results, summary: dict, alerts=None, progress=None):
+    """(msisdn, status, report) -> baris laporan (dict), satu per benefit; ringkasan dihitung sambil jalan"""
+    for msisdn, status, report in results:
+        summary["numbers"] += 1
+        error = report.error if report is not None else None
+        if status != 200 or report is None or error is not None:
+            summary["failed"] += 1
+            summary["rows"] += 1
+            yield {"msisdn": msisdn, "status": status, "error": error or f"HTTP {status}"}
+        else:
+            if alerts is not None:
+                alerts.add(msisdn, report)
+            for pkg in report.packages or [Package("-")]:
+                for b in pkg.benefits or (None,):
+                    summary["rows"] += 1
+                    pct = b.remaining_percent if b is not None else None
+                    yield {
+                        "msisdn": msisdn, "status": status, "paket": pkg.name, "masa_aktif": pkg.expiry,
+                        "benefit": b.name if b else "", "tipe": b.type if b else "",
+                        "sisa": b.remaining if b else "", "total": b.total if b else "",
+                        "sisa_persen": f"{pct:.1f}" if pct is not None else "",
+                    }
+        if progress is not None:
+            progress.update(fmt_progress(summary["numbers"], summary["total"], summary["failed"]))
+
+def write_report(rows, path: str, fmt: str = "csv") -> int:
+    """Tulis baris satu per satu ke file (tanpa menampung semua di memori); kembalikan jumlah baris"""
+    n = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "json":
+            f.write("[")
+            for row in rows:
+                f.write(("," if n else "") + "\n" + json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+                n += 1
+            f.write("\n]\n")
+        else:
+            import csv
+            writer = csv.DictWriter(f, REPORT_FIELDS, restval="")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                n += 1
+    return n
+
+def fmt_report_summary(summary: dict, elapsed: float) -> str:
+    """Caption dokumen laporan"""
+    line = (
+        f"📄 *Laporan Kuota*\n"
+        f"📱 {summary['numbers']} nomor · {summary['rows']} baris\n"
+        f"⏱️ {elapsed:.1f} detik"
+    )
+    if summary["failed"]:
+        line += f"\n❌ {summary['failed']} gagal"
+    return line
+
+def run_report_pipeline(tag: str = "REPORT", chat_ids=None, fmt: str = None, progress=None) -> bool:
+    """Cek semua nomor tenant aktif, tulis laporan CSV/JSON lalu kirim sebagai satu dokumen per chat"""
+    import tempfile
+    t = current_tenant()
+    chat_ids = list(chat_ids or t.chat_ids)
+    fmt = fmt if fmt in REPORT_FORMATS else "csv"
+    LOG.info(f"[{tag}] Laporan {fmt} untuk {len(t.msisdns)} nomor...")
+
+    started = time.monotonic()
+    summary = {"total": len(t.msisdns), "numbers": 0, "failed": 0, "rows": 0}
+    alerts = AlertEvaluator.from_config()
+    fd, path = tempfile.mkstemp(prefix="laporan-", suffix="." + fmt)
+    os.close(fd)
+    try:
+        results = check_many(t.msisdns, deadline=Deadline(RUN_BUDGET))
+        write_report(iter_report_rows(results, summary, alerts, progress), path, fmt)
+        with open(path, "rb") as f:
+            data = f.read()
+    finally:
+        os.remove(path)
+
+    name = f"laporan-kuota-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+    caption = fmt_report_summary(summary, time.monotonic() - started)
+    # Upload sekali; chat berikutnya memakai file_id dari Telegram
+    file_id = None
+    sent = 0
+    for cid in chat_ids:
+        result = tg_send_document(cid, file_id or data, name, caption)
+        if result is not None:
+            file_id = file_id or result
+            sent += 1
+    alert_msg = alerts.render() if alerts is not None else None
+    if alert_msg:
+        for cid in chat_ids:
+            tg_send_text(cid, alert_msg, "Markdown")
+
+    save_cache_snapshot()
+    LOG.info(f"[{tag}] Laporan {len(data)} byte, {summary['rows']} baris terkirim ke {sent}/{len(chat_ids)} chat")
+    return sent == len(chat_ids)
+
+# ============= Scheduler bawaan (tanpa crontab) =============
+SCHEDULER_FILE = os.path.join(STATE_DIR, "scheduler.json")
+_TZ_OFFSETS = {"Asia/Jakarta": 7, "Asia/Pontianak": 7, "Asia/Makassar": 8, "Asia/Jayapura": 9, "UTC": 0}
+
+def schedule_tz():
+    """tzinfo untuk TZ: zoneinfo jika tersedia, fallback offset tetap WIB/WITA/WIT"""
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(TZ)
+    except Exception:
+        pass
+    hours = _TZ_OFFSETS.get(TZ)
+    if hours is None:
+        LOG.info(f"[SCHEDULER] TZ {TZ} tidak dikenal, pakai waktu lokal sistem")
+        return datetime.now().astimezone().tzinfo
+    return timezone(timedelta(hours=hours), TZ)
+
+class CronExpr:
+    """Ekspresi cron 5 field (menit jam tanggal bulan hari): *, a-b, */n, a-b/n, a,b"""
+    _BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"ekspresi cron harus 5 field: {expr!r}")
+        self.expr = expr
+        parsed = [self._parse(f, lo, hi) for f, (lo, hi) in zip(fields, self._BOUNDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # 7 = Minggu juga
+        self.weekdays = {0 if d == 7 else d for d in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/", 1)
+                step = int(step)
+                if step < 1:
+                    raise ValueError(f"step tidak valid: {field!r}")
+            if part == "*":
+                a, b = lo, hi
+            elif "-" in part:
+                a, b = (int(x) for x in part.split("-", 1))
+            else:
+                a = int(part)
+                b = hi if step > 1 else a
+            if not (lo <= a <= b <= hi):
+                raise ValueError(f"nilai di luar rentang {lo}-{hi}: {field!r}")
+            values.update(range(a, b + 1, step))
+        return values
+
+    def _day_matches(self, dt) -> bool:
+        dom = dt.day in self.days
+        dow = dt.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return dom and dow
+        # Sama seperti cron: jika tanggal & hari sama-sama dibatasi, cukup salah satu cocok
+        return dom or dow
+
+    def next_after(self, dt):
+        """Waktu jalan berikutnya setelah `dt` (datetime ber-timezone), None jika tidak ada dalam 1 tahun"""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366)
+        while dt <= limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        return None
+
+class BuiltinScheduler:
+    """Jalankan pipeline cek di dalam proses daemon sesuai SCHEDULES (catch-up + jitter)"""
+
+    def __init__(self, schedules, job, store: StateStore = None, legacy_file: str = SCHEDULER_FILE,
+                 jitter: float = 0, catchup: float = 0):
+        self.tz = schedule_tz()
+        self.exprs = []
+        for s in schedules:
+            try:
+                self.exprs.append(CronExpr(s))
+            except ValueError as e:
+                LOG.info(f"[SCHEDULER] Jadwal diabaikan: {e}")
+        self.job = job
+        self.store = store or state_store()
+        self.legacy_file = legacy_file
+        self.jitter = jitter
+        self.catchup = catchup
+        self.last_run = self._load_last_run()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_last_run(self):
+        last = self.store.get("scheduler_last_run")
+        if last is None:
+            legacy = read_legacy_state(self.legacy_file)
+            try:
+                last = json.loads(legacy).get("last_run") if legacy else None
+            except (ValueError, AttributeError) as e:
+                LOG.error(f"[SCHEDULER_LOAD_ERROR] {e}")
+        try:
+            return float(last or 0) or None
+        except (TypeError, ValueError):
+            return None
+
+    def _save_last_run(self):
+        # Langsung ke disk: jadwal yang tercatat belum jalan akan diulang saat catch-up
+        self.store.set("scheduler_last_run", self.last_run, durable=True)
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def next_run(self, after=None):
+        """Jadwal terdekat setelah `after` (default: sekarang)"""
+        after = after or self.now()
+        times = [t for t in (e.next_after(after) for e in self.exprs) if t is not None]
+        return min(times) if times else None
+
+    def missed_run(self):
+        """Jadwal yang terlewat sejak run terakhir (mis. perangkat mati), dalam jendela catch-up"""
+        if not self.last_run or self.catchup <= 0:
+            return None
+        missed = self.next_run(datetime.fromtimestamp(self.last_run, self.tz))
+        now = self.now()
+        if missed is not None and missed <= now and (now - missed).total_seconds() <= self.catchup:
+            return missed
+        return None
+
+    def start(self):
+        if not self.exprs:
+            LOG.info("[SCHEDULER] Tidak ada jadwal valid, scheduler tidak dijalankan")
+            return
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        missed = self.missed_run()
+        if missed is not None:
+            LOG.info(f"[SCHEDULER] Jadwal {missed:%d-%m %H:%M} terlewat, jalankan sekarang (catch-up)")
+            self._fire()
+
+        while not self._stop.is_set():
+            nxt = self.next_run()
+            if nxt is None:
+                LOG.info("[SCHEDULER] Tidak ada jadwal berikutnya")
+                return
+            delay = random.uniform(0, self.jitter) if self.jitter > 0 else 0
+            wait = (nxt - self.now()).total_seconds() + delay
+            LOG.info(f"[SCHEDULER] Berikutnya {nxt:%d-%m %H:%M} (+{delay:.0f}s jitter)")
+            if self._stop.wait(max(0.0, wait)):
+                return
+            self._fire()
+
+    def _fire(self):
+        # job(done) boleh selesai di thread lain; hanya run yang memanggil done() dihitung sudah jalan,
+        # jadi jadwal yang dilewati/gagal tetap terdeteksi terlewat saat catch-up
+        fired = time.time()
+        try:
+            self.job(lambda: self.mark_run(fired))
+        except Exception as e:
+            LOG.error(f"[SCHEDULER_ERROR] {e}\n{format_exc()}")
+
+    def mark_run(self, fired: float):
+        """Catat jadwal yang dipicu pada `fired` sudah selesai dijalankan"""
+        with self._lock:
+            if fired <= (self.last_run or 0):
+                return
+            self.last_run = fired
+            self._save_last_run()
+
+def start_builtin_scheduler():
+    """Aktifkan scheduler tenant aktif di dalam daemon jika SCHEDULER_MODE=builtin"""
+    t = current_tenant()
+    if not BUILTIN_SCHEDULER:
+        return None
+    if not t.chat_ids or not t.msisdns:
+        LOG.info("[SCHEDULER] CHAT_ID / MSISDN_LIST kosong, scheduler tidak dijalankan")
+        return None
+
+    def job(done):
+        def run():
+            with use_tenant(t):
+                run_check_pipeline("SCHEDULER" if t is DEFAULT_TENANT else f"SCHEDULER:{t.name}")
+            done()
+
+        # Prioritas terendah di antrian tenant ini; jadwal tidak pernah ditolak karena antrian penuh
+        with use_tenant(t):
+            status = work_queue().submit(("jadwal", t.name), PRIORITY_SCHEDULED, None, run, force=True)
+        if status != "ok":
+            LOG.info("[SCHEDULER] Run sebelumnya masih antre/berjalan, jadwal ini dilewati")
+
+    t.scheduler = BuiltinScheduler(t.schedules, job, store=t.store, legacy_file=t.state_path("scheduler.json"),
+                                   jitter=SCHEDULE_JITTER, catchup=SCHEDULE_CATCHUP)
+    t.scheduler.start()
+    return t.scheduler
+
+# ============= Reload konfigurasi (tanpa restart) =============
+def _env_flag(v: str) -> bool:
+    return v == "1"
+
+def _report_format(v: str) -> str:
+    v = v.strip().lower()
+    if v not in REPORT_FORMATS:
+        raise ValueError(v)
+    return v
+
+# Nilai yang dibaca saat dipakai, jadi cukup diganti globalnya: nama -> (tipe, default)
+_RELOADABLE = {
+    "REQUEST_TIMEOUT": (int, "12"),
+    "RETRIES": (int, "2"),
+    "BACKOFF_BASE": (float, "0.5"),
+    "BACKOFF_MAX": (float, "8"),
+    "RUN_BUDGET": (float, "600"),
+    "CHECK_WORKERS": (int, "4"),
+    "CACHE_TTL": (float, "60"),
+    "TG_RETRIES": (int, "3"),
+    "TG_MAX_RETRY_AFTER": (float, "60"),
+    "CRON_DELTA": (_env_flag, "0"),
+    "DELTA_MIN_MB": (float, "100"),
+    "DELTA_MIN_PERCENT": (float, "5"),
+    "ALERT_ENABLED": (_env_flag, "0"),
+    "ALERT_MIN_MB": (float, "0"),
+    "ALERT_MIN_PERCENT": (float, "10"),
+    "ALERT_EXPIRY_DAYS": (float, "1"),
+    "PROGRESS_INTERVAL": (float, "3"),
+    "SCHEDULE_JITTER": (float, "0"),
+    "SCHEDULE_CATCHUP": (float, "21600"),
+    "LOG_LEVEL": (str, "info"),
+    "HISTORY_ENABLED": (_env_flag, "1"),
+    "REPORT_FORMAT": (_report_format, "csv"),
+    "WEBHOOK_MAX_BODY": (int, "1048576"),
+}
+# Membentuk ulang tenant default (snapshot baru, diganti dalam satu assignment)
+_TENANT_KEYS = ("CHAT_ID", "MSISDN_LIST", "SCHEDULES", "ALLOW_ANY_CHAT")
+# Butuh restart: dibaca sekali saat start (koneksi, offset, port, path, objek yang sudah dibuat).
+# Kunci yang tidak ada di tabel mana pun juga dianggap butuh restart
+_RESTART_KEYS = ("BOT_TOKEN", "STATE_DIR", "API_URL", "TELEGRAM_API_URL", "HTTP_TRANSPORT", "DAEMON_MODE",
+                 "SCHEDULER_MODE", "TZ", "TENANTS_FILE", "TENANT_WORKERS", "METRICS_PORT", "METRICS_BIND",
+                 "METRICS_DUMP_INTERVAL", "WEBHOOK_URL", "WEBHOOK_PATH", "WEBHOOK_PORT", "WEBHOOK_LISTEN",
+                 "WEBHOOK_SECRET", "WEBHOOK_CERT", "WEBHOOK_KEY", "LOG_FILE", "LOG_MAX_KB", "LOG_BACKUPS",
+                 "LOG_BUFFER", "LOG_TAG_RATE", "TG_CHAT_RATE", "TG_CHAT_BURST", "TG_GLOBAL_RATE",
+                 "HOST_CONCURRENCY", "POOL_IDLE_TIMEOUT", "POOL_MAX_IDLE", "CACHE_MAX", "CACHE_SNAPSHOT",
+                 "CB_WINDOW", "CB_MIN_CALLS", "CB_ERROR_RATE", "CB_COOLDOWN", "HISTORY_MAX_KB",
+                 "HISTORY_KEEP", "STATE_FLUSH_INTERVAL", "STATE_FSYNC", "WORK_WORKERS", "WORK_PER_CHAT",
+                 "WORK_QUEUE_MAX", "CMD_RATE", "CMD_BURST", "ASYNC_MAX_TASKS", "ASYNC_PER_CHAT",
+                 "STARTUP_BUDGET_MS", "ENV_FILE", "CONFIG_RELOAD_INTERVAL")
+
+_ENV_LINE_RE = re.compile(r"^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)$")
+_CONFIG_LOCK = threading.Lock()
+_RELOAD_EVENT = threading.Event()
+
+def parse_env_file(path: str) -> dict:
+    """Baca file env gaya shell (`export KEY="nilai"`, komentar #); tanpa eksekusi shell"""
+    env = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            m = _ENV_LINE_RE.match(line)
+            if not m:
                 continue
-            
-            name = _first_existing(pkg, ["name", "package"], "Paket")
-            exp  = _first_existing(pkg, ["expiry_date", "expired_at", "expire"], "-")
-            
-            detail_lines.append("")
-            detail_lines.append(f"┌─ PAKET {pkg_idx}: {name}")
-            detail_lines.append(f"└─ Berlaku sampai: {exp}")
-            detail_lines.append("")
-            
-            details = pkg.get("details") or pkg.get("detail") or []
-            if details and isinstance(details, list) and len(details) > 0:
-                for d in _to_list(details):
-                    if not isinstance(d, dict):
-                        continue
-                    
-                    typ = str(_first_existing(d, ["type"], "")).upper()
-                    benefit = _first_existing(d, ["benefit", "name"], typ or "Kuota")
-                    total = _first_existing(d, ["total_quota", "total", "quota_total"], "-")
-                    remain = _first_existing(d, ["remaining_quota", "remaining", "quota_remaining"], "-")
-                    usedp = _first_existing(d, ["used_percentage", "percent_used"], "-")
-                    remp  = _first_existing(d, ["remaining_percentage", "percent_remaining"], "-")
-
-                    detail_lines.append(f"  • {benefit}")
-                    detail_lines.append(f"    Sisa      : {remain}")
-                    detail_lines.append(f"    Total     : {total}")
-                    
-                    if remp and "%" in str(remp):
-                        detail_lines.append(f"    Persentase : {remp}")
-                    elif usedp and "%" in str(usedp):
-                        detail_lines.append(f"    Terpakai   : {usedp}")
-                    detail_lines.append("")
+            value = m.group(2).strip()
+            if value[:1] in ("'", '"'):
+                end = value.find(value[0], 1)
+                value = value[1:end] if end > 0 else value[1:]
             else:
-                detail_lines.append("  ℹ️  Tidak ada detail")
-                detail_lines.append("")
-        
-        detail_text = "\n".join(detail_lines).strip()
-        header = ("📊 Cek Kuota Berhasil", "Lihat detail di bawah")
-        return header, detail_text
-        
-    except Exception as e:
-        print(f"[RENDER_ERROR] {e}")
-        return ("⚠️ Parsing Error", str(e)), ""
+                value = value.split(" #", 1)[0].strip()
+            env[m.group(1)] = value
+    return env
 
-def fmt_result(msisdn: str, status: int, data):
-    """Format hasil cek kuota untuk dikirim ke Telegram"""
+def _build_default_tenant(env: dict, old: Tenant) -> Tenant:
+    """Tenant default baru dari env; limiter & token tetap, nomor dihitung ulang sebagai diff"""
+    chat_ids = [x.strip() for x in env.get("CHAT_ID", "").split(",") if x.strip()]
+    raw = [x.strip() for x in env.get("MSISDN_LIST", "").split(",") if x.strip()]
+    schedules = [x.strip() for x in (env.get("SCHEDULES") or DEFAULT_SCHEDULES).split(",") if x.strip()]
+    t = Tenant(old.name, old.token, chat_ids, MsisdnIndex(raw), schedules, env.get("ALLOW_ANY_CHAT") == "1")
+    t._limiter = old._limiter
+    t._work = old._work
+    return t
+
+def reload_config(path: str = None) -> bool:
+    """Terapkan ENV_FILE ke proses yang berjalan; True jika ada yang berubah.
+    Kunci yang dihapus dari file diabaikan (nilai lama tetap dipakai)"""
+    global DEFAULT_TENANT, CHAT_IDS, MSISDN_INDEX, MSISDNS, SCHEDULES, ALLOW_ANY_CHAT
+    path = path or ENV_FILE
     try:
-        (header_title, header_sub), detail = render_quota_details(data if isinstance(data, dict) else {})
-        
-        if status == 200:
-            result = f"*{header_title}*\n_{header_sub}_\n\n📱 Nomor: `{msisdn}`"
-        else:
-            result = f"*❌ Gagal Cek Kuota*\nStatus: `{status}`\n📱 Nomor: `{msisdn}`"
-        
-        if detail:
-            result += f"\n\n```\n{detail}\n```"
-        
-        return result
-        
+        env = parse_env_file(path)
     except Exception as e:
-        print(f"[FMT_RESULT_ERROR] {e}")
-        return f"*❌ Error*\nNomor: `{msisdn}`\nError: {str(e)}"
+        LOG.error(f"[CONFIG_ERROR] Gagal membaca {path}: {e}")
+        return False
 
-# ============= Panggil API cek kuota =============
-def api_check(msisdn: str):
-    """Cek kuota via API"""
+    with _CONFIG_LOCK:
+        changed = sorted(k for k, v in env.items() if os.environ.get(k) != v)
+        if not changed:
+            return False
+        for k in changed:
+            os.environ[k] = env[k]
+
+        for k in changed:
+            if k in _RELOADABLE:
+                cast, default = _RELOADABLE[k]
+                try:
+                    globals()[k] = cast(env[k] or default)
+                except ValueError:
+                    LOG.warning(f"[CONFIG] {k}={env[k]!r} tidak valid, diabaikan")
+        if "CACHE_TTL" in changed:
+            QUOTA_CACHE.ttl = CACHE_TTL
+        if "LOG_LEVEL" in changed:
+            LOG.level = LOG_LEVELS.get(LOG_LEVEL.lower(), LOG.level)
+
+        old = DEFAULT_TENANT
+        if any(k in changed for k in _TENANT_KEYS + ("SCHEDULE_JITTER", "SCHEDULE_CATCHUP")):
+            current = {k: os.environ.get(k, "") for k in _TENANT_KEYS}
+            new = _build_default_tenant(current, old)
+            added, removed = new.msisdns.diff(old.msisdns)
+            for msisdn in removed:
+                QUOTA_CACHE.invalidate(msisdn)
+            new.msisdns.report()
+            # Satu assignment: thread lain melihat snapshot lama atau baru, tidak pernah campuran
+            DEFAULT_TENANT = new
+            CHAT_IDS, MSISDN_INDEX, MSISDNS = new.chat_ids, new.msisdns, new.msisdns.numbers
+            SCHEDULES, ALLOW_ANY_CHAT = new.schedules, new.allow_any_chat
+            LOG.info(f"[CONFIG] Tenant diperbarui: {len(new.chat_ids)} chat, {len(new.msisdns)} nomor "
+                     f"(+{len(added)} / -{len(removed)})")
+            if old.scheduler is not None:
+                old.scheduler.stop()
+            with use_tenant(new):
+                start_builtin_scheduler()
+
+    restart = [k for k in changed if k not in _RELOADABLE and k not in _TENANT_KEYS]
+    unknown = [k for k in restart if k not in _RESTART_KEYS]
+    LOG.info(f"[CONFIG] Dimuat ulang dari {path}: {', '.join(changed)}")
+    if restart:
+        LOG.warning(f"[CONFIG] Perlu restart agar berlaku: {', '.join(restart)}")
+    if unknown:
+        LOG.warning(f"[CONFIG] Kunci tidak dikenal (tidak diterapkan tanpa restart): {', '.join(unknown)}")
+    return True
+
+def _config_watch_loop(path: str, interval: float):
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-FDZ-Key": EDGE_HEADER_KEY,
-            "User-Agent": "cekkuota-bot/1.5"
-        }
-        payload = {"msisdn": msisdn}
-        
-        status, data = http_post_json(API_URL, payload, headers)
-        
-        if status == 0 and RETRIES > 0:
-            time.sleep(0.25)
-            status, data = http_post_json(API_URL, payload, headers)
-        
-        return status, data
-        
-    except Exception as e:
-        print(f"[API_CHECK_ERROR] {msisdn}: {e}")
-        return 0, None
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    while True:
+        forced = _RELOAD_EVENT.wait(interval if interval > 0 else None)
+        _RELOAD_EVENT.clear()
+        try:
+            current = os.stat(path).st_mtime
+        except OSError:
+            current = None
+        if forced or (current is not None and current != mtime):
+            mtime = current
+            try:
+                reload_config(path)
+            except Exception as e:
+                LOG.error(f"[CONFIG_ERROR] {e}\n{format_exc()}")
 
-# ============= Mode CRON =============
-def cron_run():
-    """Jalankan cek kuota untuk semua nomor (gunakan dengan cron)"""
-    missing = []
-    if not BOT_TOKEN:
-        missing.append("BOT_TOKEN")
-    if not CHAT_IDS:
-        missing.append("CHAT_ID")
-    if not MSISDNS:
-        missing.append("MSISDN_LIST")
-    
-    if missing:
-        print(f"[ERROR] ENV kurang: {', '.join(missing)}")
+def start_config_watcher():
+    """Pantau ENV_FILE (mtime tiap CONFIG_RELOAD_INTERVAL detik) dan SIGHUP untuk reload konfigurasi"""
+    if not ENV_FILE:
         return
+    if threading.current_thread() is threading.main_thread():
+        import signal
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: _RELOAD_EVENT.set())
+    threading.Thread(target=_config_watch_loop, args=(ENV_FILE, CONFIG_RELOAD_INTERVAL),
+                     name="config-watch", daemon=True).start()
+    LOG.info(f"[CONFIG] Memantau {ENV_FILE} (interval {CONFIG_RELOAD_INTERVAL:g}s, SIGHUP)")
 
-    print(f"[CRON] Cek kuota untuk {len(MSISDNS)} nomor...")
-    
-    for msisdn in MSISDNS:
-        if not valid_msisdn(msisdn):
-            for cid in CHAT_IDS:
-                tg_send_text(cid, f"⚠️ Nomor tidak valid: `{msisdn}`", "Markdown")
-            continue
-        
-        status, data = api_check(msisdn)
-        msg = fmt_result(msisdn, status, data)
-        
-        for cid in CHAT_IDS:
-            tg_send_text(cid, msg, "Markdown")
-        
-        time.sleep(0.2)
-    
-    print("[CRON] Selesai!")
+# ============= Antrian kerja (prioritas & admission control) =============
+PRIORITY_INTERACTIVE = 0  # /ping, /cek, menu, tombol
+PRIORITY_BULK = 1         # /cek_all, /laporan
+PRIORITY_SCHEDULED = 2    # scheduler bawaan
+BULK_COMMANDS = ("/cek_all", "/laporan")
+BUSY_NOTICE_INTERVAL = 10.0
+WORK_IDLE_TIMEOUT = 60.0
+
+class WorkQueue:
+    """Antrian kerja satu bot dengan prioritas: perintah interaktif didahulukan dari /cek_all & jadwal.
+    Job dengan kunci sama yang masih antre/berjalan tidak dimasukkan dua kali; tiap chat paling banyak
+    `per_chat` job per kelas (interaktif / non-interaktif) berjalan bersamaan, jadi /ping dari chat
+    yang sedang menjalankan /cek_all tidak ikut menunggu. Job non-interaktif memakai paling banyak `workers - 1` worker,
+    jadi /ping & /cek tidak pernah menunggu /cek_all atau jadwal selesai. Worker dibuat saat ada job
+    dan berhenti setelah WORK_IDLE_TIMEOUT tanpa kerja, jadi bot yang sepi tidak memegang thread"""
+
+    def __init__(self, workers: int = 2, maxsize: int = 32, per_chat: int = 1, name: str = ""):
+        self.name = name
+        self.workers = max(2, workers)
+        self.maxsize = max(1, maxsize)
+        self.per_chat = max(1, per_chat)
+        self._heap = []
+        self._seq = 0
+        self._keys = set()
+        self._running = {}
+        self._bulk = 0
+        self._threads = 0
+        self._idle = 0
+        self._cond = threading.Condition()
+
+    def submit(self, key, priority: int, chat, fn, args=(), on_done=None, force: bool = False) -> str:
+        """Masukkan job; hasilnya "ok", "duplicate" (kunci sama masih antre/berjalan) atau "full" (antrian penuh)"""
+        with self._cond:
+            if key is not None and key in self._keys:
+                return "duplicate"
+            if not force and len(self._heap) >= self.maxsize:
+                return "full"
+            self._seq += 1
+            heapq.heappush(self._heap, (priority, self._seq, key, chat, fn, args, on_done))
+            if key is not None:
+                self._keys.add(key)
+            if self._idle == 0 and self._threads < self.workers:
+                self._threads += 1
+                threading.Thread(target=self._worker, name=f"work-{self.name}-{self._threads}",
+                                 daemon=True).start()
+            self._cond.notify_all()
+        return "ok"
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"queued": len(self._heap), "running": sum(self._running.values())}
+
+    def _next(self):
+        """Job prioritas tertinggi yang boleh mulai (dipanggil dengan lock): chat-nya belum mencapai
+        batas paralel, dan job non-interaktif hanya jika masih tersisa worker untuk perintah interaktif"""
+        bulk_full = self._bulk >= self.workers - 1
+        for item in sorted(self._heap):
+            if item[0] > PRIORITY_INTERACTIVE and bulk_full:
+                break
+            chat = item[3]
+            if chat is None or self._running.get((chat, item[0] > PRIORITY_INTERACTIVE), 0) < self.per_chat:
+                self._heap.remove(item)
+                heapq.heapify(self._heap)
+                return item
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                item = self._next()
+                while item is None:
+                    self._idle += 1
+                    woken = self._cond.wait(WORK_IDLE_TIMEOUT)
+                    self._idle -= 1
+                    item = self._next()
+                    if item is None and not woken:
+                        self._threads -= 1
+                        return
+                priority, _, key, chat, fn, args, on_done = item
+                if priority > PRIORITY_INTERACTIVE:
+                    self._bulk += 1
+                slot = (chat, priority > PRIORITY_INTERACTIVE)
+                if chat is not None:
+                    self._running[slot] = self._running.get(slot, 0) + 1
+            try:
+                fn(*args)
+            except Exception as e:
+                LOG.error(f"[WORK_ERROR] {e}\n{format_exc()}")
+            finally:
+                with self._cond:
+                    if priority > PRIORITY_INTERACTIVE:
+                        self._bulk -= 1
+                    if chat is not None:
+                        self._running[slot] -= 1
+                        if not self._running[slot]:
+                            del self._running[slot]
+                    self._keys.discard(key)
+                    self._cond.notify_all()
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception as e:
+                    LOG.error(f"[WORK_ERROR] on_done: {e}")
+
+_work_size = [WORK_WORKERS, WORK_PER_CHAT]
+_work_queues = []
+_work_queue_lock = threading.Lock()
+_cmd_limiters = LimiterTable(CMD_RATE, CMD_BURST)
+_busy_notices = {}
+_busy_swept = [0.0]
+_notices = deque(maxlen=256)
+_notice_event = threading.Event()
+_notice_thread = []
+
+def configure_work_queue(workers: int, per_chat: int):
+    """Ukuran antrian kerja yang dibuat setelah ini (mode async memakai ASYNC_MAX_TASKS/ASYNC_PER_CHAT)"""
+    _work_size[:] = [workers, per_chat]
+
+def work_queue() -> WorkQueue:
+    """Antrian kerja tenant aktif; tiap bot punya worker & batas antriannya sendiri"""
+    t = current_tenant()
+    with _work_queue_lock:
+        if t._work is None:
+            t._work = WorkQueue(_work_size[0], WORK_QUEUE_MAX, _work_size[1], name=t.name)
+            _work_queues.append(t._work)
+        return t._work
+
+def work_stats() -> dict:
+    """Jumlah job antre/berjalan di semua antrian kerja proses ini"""
+    with _work_queue_lock:
+        queues = list(_work_queues)
+    total = {"queued": 0, "running": 0}
+    for q in queues:
+        for k, v in q.stats().items():
+            total[k] += v
+    return total
+
+def command_priority(text: str, callback: dict = None) -> int:
+    if callback is None and command_label(text) in BULK_COMMANDS:
+        return PRIORITY_BULK
+    return PRIORITY_INTERACTIVE
+
+def _admit(chat) -> bool:
+    """Token bucket per chat (CMD_RATE perintah/detik, burst CMD_BURST)"""
+    return _cmd_limiters.get(chat).try_acquire()
+
+def _run_queued(tenant, cmd):
+    with use_tenant(tenant):
+        run_command(*cmd)
+
+def _reply_rejected(chat_id, chat, callback: dict, reason: str):
+    """Balasan cepat untuk perintah yang ditolak; notifikasi chat dibatasi satu per BUSY_NOTICE_INTERVAL"""
+    if reason == "duplicate":
+        short, text = "⏳ Masih diproses", "⏳ Perintah yang sama masih diproses, tunggu hasilnya."
+    elif reason == "full":
+        short, text = "🚧 Bot sedang sibuk", "🚧 *Bot sedang sibuk*\nCoba lagi dalam beberapa saat."
+    else:
+        short, text = "🐢 Terlalu cepat", "🐢 *Terlalu banyak perintah*\nTunggu sebentar lalu coba lagi."
+    if callback is not None:
+        _post_notice(tg_answer_callback, callback.get("id"), short)
+        return
+    now = time.monotonic()
+    with _work_queue_lock:
+        if now - _busy_swept[0] >= BUSY_NOTICE_INTERVAL:
+            _busy_swept[0] = now
+            for k in [k for k, v in _busy_notices.items() if now - v >= BUSY_NOTICE_INTERVAL]:
+                del _busy_notices[k]
+        if now - _busy_notices.get(chat, -BUSY_NOTICE_INTERVAL) < BUSY_NOTICE_INTERVAL:
+            return
+        _busy_notices[chat] = now
+    _post_notice(tg_send_text, chat_id, text)
+
+def _notice_loop():
+    while True:
+        _notice_event.wait()
+        _notice_event.clear()
+        while _notices:
+            tenant, fn, args = _notices.popleft()
+            try:
+                with use_tenant(tenant):
+                    fn(*args)
+            except Exception as e:
+                LOG.error(f"[ADMISSION_ERROR] {e}")
+
+def _post_notice(fn, *args):
+    """Kirim balasan penolakan dari thread sendiri, jadi penerima update (poll/webhook) tidak ikut
+    menunggu rate limit & retry Telegram; jika antrian balasan penuh, yang terlama dibuang"""
+    _notices.append((getattr(_tenant_local, "tenant", None), fn, args))
+    with _work_queue_lock:
+        if not _notice_thread:
+            th = threading.Thread(target=_notice_loop, name="busy-notice", daemon=True)
+            _notice_thread.append(th)
+            th.start()
+    _notice_event.set()
+
+def dispatch_command(cmd, on_done=None) -> bool:
+    """Masukkan perintah (hasil parse_update) ke antrian kerja setelah lolos admission per chat.
+    False jika ditolak (rate limit, duplikat, antrian penuh); `on_done` tetap dipanggil"""
+    chat_id, text = cmd[0], cmd[1]
+    callback = cmd[2] if len(cmd) > 2 else None
+    chat = (current_tenant().name, str(chat_id))
+    if not _admit(chat):
+        reason = "rate_limited"
+    else:
+        key = chat + (" ".join(text.split()).lower(),)
+        tenant = getattr(_tenant_local, "tenant", None)
+        reason = work_queue().submit(key, command_priority(text, callback), chat,
+                                     _run_queued, (tenant, cmd), on_done)
+        if reason == "ok":
+            return True
+    METRICS.inc("commands_rejected_total", reason=reason)
+    LOG.warning(f"[ADMISSION] {reason}: chat_id={chat_id}, text={text[:30]}")
+    try:
+        _reply_rejected(chat_id, chat, callback, reason)
+    finally:
+        if on_done is not None:
+            on_done()
+    return False
 
 # ============= Telegram daemon (long polling) =============
-OFFSET_FILE = os.path.join(STATE_DIR, "updates_offset.txt")
+ALLOWED_UPDATES = json.dumps(["message", "edited_message", "callback_query"])
+OFFSET_FILE = "updates_offset.txt"  # format lama, hanya dibaca untuk migrasi
 
 def load_offset():
-    """Load offset dari file"""
+    """Load offset dari state.json tenant (fallback: updates_offset.txt lama)"""
+    t = current_tenant()
+    val = t.store.get("offset")
+    if val is None:
+        val = (read_legacy_state(t.state_path(OFFSET_FILE)) or "").strip()
     try:
-        with open(OFFSET_FILE, "r") as f:
-            val = f.read().strip()
-            return int(val) if val else 0
-    except FileNotFoundError:
-        return 0
-    except Exception as e:
-        print(f"[LOAD_OFFSET_ERROR] {e}")
+        return int(val) if val else 0
+    except (TypeError, ValueError) as e:
+        LOG.error(f"[LOAD_OFFSET_ERROR] {e}")
         return 0
 
 def save_offset(n):
-    """Save offset ke file"""
-    try:
-        with open(OFFSET_FILE, "w") as f:
-            f.write(str(int(n)))
-    except Exception as e:
-        print(f"[SAVE_OFFSET_ERROR] {e}")
+    """Simpan offset ke state.json tenant; ditulis ke disk bersama perubahan lain saat flush.
+    Update yang sudah dikonfirmasi lewat getUpdates berikutnya tidak dikirim ulang Telegram,
+    jadi offset yang tertinggal beberapa detik saat listrik padam tidak memutar ulang perintah lama"""
+    current_tenant().store.set("offset", int(n))
 
 def is_allowed_chat(chat_id: int) -> bool:
     """Check apakah chat_id diizinkan"""
-    if ALLOW_ANY_CHAT:
+    t = current_tenant()
+    if t.allow_any_chat:
         return True
-    return str(chat_id) in CHAT_IDS
+    return str(chat_id) in t.chat_ids
+
+def is_admin_chat(chat_id: int) -> bool:
+    """Chat di CHAT_ID; perintah diagnostik (/stats, /log) tidak dibuka untuk ALLOW_ANY_CHAT"""
+    return str(chat_id) in current_tenant().chat_ids
 
 def handle_command(chat_id: int, text: str):
     """Handle Telegram command"""
@@ -377,12 +3335,12 @@ def handle_command(chat_id: int, text: str):
         if not text:
             return
         
-        print(f"[COMMAND] chat_id={chat_id}, text={text[:50]}")
+        LOG.debug(f"[COMMAND] chat_id={chat_id}, text={text[:50]}")
         
         lower = text.lower().split("@")[0]
 
         if lower in ("/start", "/mbot", "/menu"):
-            print(f"[ACTION] Menu command dari {chat_id}")
+            LOG.debug(f"[ACTION] Menu command dari {chat_id}")
             
             if lower == "/start":
                 menu = (
@@ -399,61 +3357,144 @@ def handle_command(chat_id: int, text: str):
                     "🔍 /cek <nomor> – Cek satu nomor\n"
                     "   _Contoh: /cek 08812345678_\n\n"
                     "📊 /cek_all – Cek semua nomor terdaftar\n"
+                    "📄 /laporan [csv|json] – Semua nomor dalam satu file\n"
+                    "📱 /nomor – Pilih nomor lewat tombol\n"
                     "🕒 /jadwal – Lihat jadwal cek otomatis\n"
+                    "🗂️ /riwayat <nomor> – Riwayat kuota tersimpan\n"
+                    "📊 /stats – Statistik & latensi bot\n"
+                    "📜 /log [jumlah] [level] – Log terakhir dari memori\n"
                     "🏓 /ping – Cek status bot"
                 )
             result = tg_send_text(str(chat_id), menu, "Markdown")
-            print(f"[RESULT] Menu send: {result}")
+            LOG.debug(f"[RESULT] Menu send: {result}")
             return
 
         if lower == "/ping":
-            print(f"[ACTION] Ping command dari {chat_id}")
+            LOG.debug(f"[ACTION] Ping command dari {chat_id}")
             result = tg_send_text(str(chat_id), "🏓 *Pong! Bot Online*\nKoneksi baik, siap melayani 👍", "Markdown")
-            print(f"[RESULT] Ping send: {result}")
+            LOG.debug(f"[RESULT] Ping send: {result}")
+            return
+
+        if (lower == "/stats" or lower.startswith("/log")) and not is_admin_chat(chat_id):
+            LOG.warning(f"[BLOCKED] {lower.split()[0]} dari chat non-admin: {chat_id}")
+            tg_send_text(str(chat_id), "⛔ Perintah ini hanya untuk chat di `CHAT_ID`.", "Markdown")
+            return
+
+        if lower == "/stats":
+            LOG.debug(f"[ACTION] Stats command dari {chat_id}")
+            result = tg_send_text(str(chat_id), fmt_stats(), "Markdown")
+            LOG.debug(f"[RESULT] Stats send: {result}")
+            return
+
+        if lower.startswith("/log"):
+            LOG.debug(f"[ACTION] Log command dari {chat_id}")
+            parts = lower.split()
+            limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 20
+            level = LOG_LEVELS.get(parts[2] if len(parts) > 2 else "debug", LOG_LEVELS["debug"])
+            tg_send_text(str(chat_id), fmt_log_tail(max(1, min(limit, 200)), level), "Markdown")
             return
 
         if lower == "/jadwal":
-            print(f"[ACTION] Jadwal command dari {chat_id}")
-            sch_text = "\n".join([f"  ⏱️  {s}" for s in SCHEDULES]) if SCHEDULES else "  Tidak ada jadwal"
+            LOG.debug(f"[ACTION] Jadwal command dari {chat_id}")
+            t = current_tenant()
+            sch_text = "\n".join([f"  ⏱️  {s}" for s in t.schedules]) if t.schedules else "  Tidak ada jadwal"
+            nxt = t.scheduler.next_run() if t.scheduler else None
             body = (
                 "📅 *JADWAL CEK OTOMATIS*\n\n"
                 f"🌍 Zona: *{TZ}*\n"
-                f"Frekuensi: *{len(SCHEDULES)}x per hari*\n\n"
-                f"*Jam Cek (format cron):*\n{sch_text}\n\n"
-                f"*Nomor Pantau ({len(MSISDNS)}):*\n" +
-                ("\n".join([f"  • {x}" for x in MSISDNS]) if MSISDNS else "  Tidak ada nomor")
+                f"Frekuensi: *{len(t.schedules)}x per hari*\n\n"
+                f"*Jam Cek (format cron):*\n{sch_text}\n\n" +
+                (f"⏭️ Berikutnya (scheduler bawaan): *{nxt:%d-%m-%Y %H:%M}*\n\n" if nxt else "") +
+                f"*Nomor Pantau ({len(t.msisdns)}):*\n" +
+                ("\n".join([f"  • {x}" for x in t.msisdns]) if t.msisdns else "  Tidak ada nomor")
             )
+            if t.msisdns.invalid:
+                body += (
+                    f"\n\n*Diabaikan, tidak valid ({len(t.msisdns.invalid)}):*\n" +
+                    "\n".join([f"  • `{x}`" for x in t.msisdns.invalid])
+                )
             result = tg_send_text(str(chat_id), body, "Markdown")
-            print(f"[RESULT] Jadwal send: {result}")
+            LOG.debug(f"[RESULT] Jadwal send: {result}")
+            return
+
+        if lower == "/nomor":
+            LOG.debug(f"[ACTION] Nomor command dari {chat_id}")
+            msisdns = current_tenant().msisdns
+            if not msisdns:
+                tg_send_text(str(chat_id), "⚠️ Tidak ada nomor terdaftar", "Markdown")
+                return
+            tg_send_message(str(chat_id), "📱 *Pilih nomor untuk dicek:*", "Markdown", numbers_keyboard(msisdns))
+            return
+
+        if lower.startswith("/laporan"):
+            LOG.debug(f"[ACTION] Laporan command dari {chat_id}")
+            msisdns = current_tenant().msisdns
+            if not msisdns:
+                tg_send_text(str(chat_id), "⚠️ Tidak ada nomor terdaftar", "Markdown")
+                return
+            parts = lower.split()
+            fmt = parts[1] if len(parts) > 1 and parts[1] in REPORT_FORMATS else REPORT_FORMAT
+            progress = ProgressMessage(chat_id, PROGRESS_INTERVAL)
+            progress.start(fmt_progress(0, len(msisdns)))
+            ok = run_report_pipeline("LAPORAN", [chat_id], fmt, progress)
+            progress.finish("✅ *Laporan terkirim*" if ok else "❌ *Laporan gagal dikirim*")
+            LOG.debug(f"[RESULT] Laporan done, ok={ok}")
             return
 
         if lower == "/cek_all":
-            print(f"[ACTION] Cek_all command dari {chat_id}")
-            if not MSISDNS:
+            LOG.debug(f"[ACTION] Cek_all command dari {chat_id}")
+            msisdns = current_tenant().msisdns
+            if not msisdns:
                 tg_send_text(str(chat_id), "⚠️ Tidak ada nomor terdaftar", "Markdown")
                 return
             
-            tg_send_text(str(chat_id), f"⏳ *Sedang cek {len(MSISDNS)} nomor...*", "Markdown")
-            for msisdn in MSISDNS:
-                if not valid_msisdn(msisdn):
-                    tg_send_text(str(chat_id), f"⚠️ Nomor tidak valid: `{msisdn}`", "Markdown")
-                    continue
-                status, data = api_check(msisdn)
-                tg_send_text(str(chat_id), fmt_result(msisdn, status, data), "Markdown")
-                time.sleep(0.2)
-            tg_send_text(str(chat_id), "✅ *Selesai!*\nSemua nomor sudah dicek", "Markdown")
-            print(f"[RESULT] Cek_all done")
+            total = len(msisdns)
+            started = time.monotonic()
+            progress = ProgressMessage(chat_id, PROGRESS_INTERVAL)
+            progress.start(fmt_progress(0, total))
+            alerts = AlertEvaluator.from_config()
+            outbox = Outbox("Markdown")
+            done = failed = 0
+            for msisdn, status, report in check_many(msisdns, deadline=Deadline(RUN_BUDGET)):
+                if alerts is not None and status == 200:
+                    alerts.add(msisdn, report)
+                done += 1
+                if status != 200:
+                    failed += 1
+                outbox.add(chat_id, fmt_result(msisdn, status, report))
+                progress.update(fmt_progress(done, total, failed))
+            alert_msg = alerts.render() if alerts is not None else None
+            if alert_msg:
+                outbox.add(chat_id, alert_msg)
+            outbox.flush()
+            summary = f"✅ *Selesai!*\n{done} nomor dicek dalam {time.monotonic() - started:.1f} detik"
+            if failed:
+                summary += f" (❌ {failed} gagal)"
+            progress.finish(summary)
+            LOG.debug(f"[RESULT] Cek_all done, {outbox.sent} pesan + {progress.edits} edit, pool={TRANSPORT.stats()}")
+            return
+
+        if lower.startswith("/riwayat"):
+            LOG.debug(f"[ACTION] Riwayat command dari {chat_id}")
+            parts = text.split()
+            msisdn = normalize_msisdn(parts[1]) if len(parts) > 1 else None
+            if msisdn is None:
+                tg_send_text(str(chat_id), "❌ *Format salah!*\n\nGunakan: `/riwayat 08812345678 [jumlah]`", "Markdown")
+                return
+            limit = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 5
+            tg_send_text(str(chat_id), fmt_history(msisdn, max(1, min(limit, 50))), "Markdown")
+            LOG.debug(f"[RESULT] Riwayat done for {msisdn}")
             return
 
         if lower.startswith("/cek"):
-            print(f"[ACTION] Cek command dari {chat_id}")
+            LOG.debug(f"[ACTION] Cek command dari {chat_id}")
             parts = text.split()
             if len(parts) < 2:
                 tg_send_text(str(chat_id), "❌ *Format salah!*\n\nGunakan: `/cek 08812345678`", "Markdown")
                 return
             
-            msisdn = parts[1].strip()
-            if not valid_msisdn(msisdn):
+            msisdn = normalize_msisdn(parts[1])
+            if msisdn is None:
                 tg_send_text(str(chat_id),
                     "⚠️ *Nomor tidak valid!*\n\n"
                     "Format yang benar:\n"
@@ -463,43 +3504,133 @@ def handle_command(chat_id: int, text: str):
                 return
             
             tg_send_text(str(chat_id), f"⏳ *Cek kuota*\n`{msisdn}`", "Markdown")
-            status, data = api_check(msisdn)
-            tg_send_text(str(chat_id), fmt_result(msisdn, status, data), "Markdown")
-            print(f"[RESULT] Cek done for {msisdn}")
+            status, report = api_check(msisdn)
+            send_result(chat_id, msisdn, status, report)
+            LOG.debug(f"[RESULT] Cek done for {msisdn}")
             return
 
-        print(f"[WARNING] Command tidak dikenali: {lower}")
+        LOG.warning(f"[WARNING] Command tidak dikenali: {lower}")
         tg_send_text(str(chat_id),
             "❓ *Perintah tidak dikenali*\n\n"
             "Ketik `/mbot` untuk melihat bantuan", "Markdown")
             
     except Exception as e:
-        print(f"[HANDLE_COMMAND_ERROR] {e}\n{traceback.format_exc()}")
+        LOG.error(f"[HANDLE_COMMAND_ERROR] {e}\n{format_exc()}")
         tg_send_text(str(chat_id), f"❌ Error: {str(e)[:100]}", "Markdown")
 
+def send_result(chat_id, msisdn: str, status: int, report, message_id: int = None):
+    """Kirim hasil cek satu nomor dengan tombol refresh; jika message_id diisi, pesan itu yang diedit"""
+    parts = split_message(fmt_result(msisdn, status, report))
+    keyboard = result_keyboard(msisdn)
+    # Tombol ada di potongan terakhir; hasil yang dipecah tidak bisa diedit di tempat
+    if message_id and len(parts) == 1:
+        if tg_edit_message(str(chat_id), message_id, parts[0], "Markdown", keyboard):
+            return
+    for part in parts[:-1]:
+        tg_send_message(str(chat_id), part, "Markdown")
+    tg_send_message(str(chat_id), parts[-1], "Markdown", keyboard)
+
+def handle_callback(chat_id: int, data: str, callback: dict):
+    """Handle tombol inline; pesan asal diedit di tempat, hasil cek memakai cache bila masih segar"""
+    LOG.debug(f"[CALLBACK] chat_id={chat_id}, data={data[:64]}")
+    try:
+        if data == CALLBACK_NUMBERS:
+            tg_answer_callback(callback["id"])
+            msisdns = current_tenant().msisdns
+            tg_edit_message(str(chat_id), callback["message_id"], "📱 *Pilih nomor untuk dicek:*",
+                            "Markdown", numbers_keyboard(msisdns))
+            return
+
+        if data.startswith(CALLBACK_CHECK):
+            msisdn = normalize_msisdn(data[len(CALLBACK_CHECK):])
+            if msisdn is None:
+                tg_answer_callback(callback["id"], "⚠️ Nomor tidak valid")
+                return
+            tg_answer_callback(callback["id"], f"⏳ Cek {msisdn}...")
+            status, report = api_check(msisdn)
+            send_result(chat_id, msisdn, status, report, callback["message_id"])
+            LOG.debug(f"[RESULT] Callback cek done for {msisdn}")
+            return
+
+        tg_answer_callback(callback["id"], "❓ Tombol tidak dikenali")
+    except Exception as e:
+        LOG.error(f"[HANDLE_CALLBACK_ERROR] {e}\n{format_exc()}")
+
+def run_command(chat_id: int, text: str, callback: dict = None):
+    """Jalankan satu perintah/tombol (dengan pencatatan durasi) lalu simpan snapshot cache"""
+    if callback is not None:
+        with METRICS.timer("command_seconds", command="callback"):
+            handle_callback(chat_id, text, callback)
+    else:
+        with METRICS.timer("command_seconds", command=command_label(text)):
+            handle_command(chat_id, text)
+    save_cache_snapshot()
+
+def parse_update(upd: dict):
+    """Ambil (chat_id, text) dari update Telegram, atau (chat_id, data, callback) untuk tombol inline;
+    None jika bukan perintah dari chat yang diizinkan"""
+    cq = upd.get("callback_query")
+    if cq:
+        msg = cq.get("message") or {}
+        chat_id = msg.get("chat", {}).get("id")
+        if chat_id is None or not cq.get("data") or not is_allowed_chat(chat_id):
+            LOG.warning(f"[BLOCKED] Callback diabaikan: chat_id={chat_id}")
+            return None
+        return chat_id, cq["data"], {"id": cq.get("id"), "message_id": msg.get("message_id")}
+
+    msg = upd.get("message") or upd.get("edited_message")
+    if not msg:
+        return None
+    
+    chat = msg.get("chat", {})
+    chat_id = chat.get("id")
+    text = msg.get("text", "")
+    
+    if chat_id is None or not text:
+        return None
+    
+    LOG.debug(f"[UPDATE] chat_id={chat_id}, text={text[:50]}")
+    
+    if not is_allowed_chat(chat_id):
+        LOG.warning(f"[BLOCKED] Unauthorized chat: {chat_id}")
+        return None
+    
+    LOG.debug(f"[PROCESSING] Command from {chat_id}")
+    return chat_id, text
+
 def send_startup_notification():
     """Kirim notifikasi bot aktif"""
-    if not CHAT_IDS:
-        print("[WARNING] CHAT_IDS kosong")
+    t = current_tenant()
+    if not t.chat_ids:
+        LOG.warning("[WARNING] CHAT_IDS kosong")
         return
     
     info = (
         "✅ *BOT AKTIF*\n\n"
         f"🌍 Zona: `{TZ}`\n"
-        f"📱 Nomor: {len(MSISDNS)} terdaftar\n"
-        f"⏱️  Jadwal: {len(SCHEDULES)}x per hari\n\n"
+        f"📱 Nomor: {len(t.msisdns)} terdaftar\n"
+        f"⏱️  Jadwal: {len(t.schedules)}x per hari\n\n"
         "Ketik /mbot untuk bantuan"
     )
-    for cid in CHAT_IDS:
+    if t.msisdns.invalid:
+        info += f"\n\n⚠️ {len(t.msisdns.invalid)} nomor tidak valid diabaikan, lihat /jadwal"
+    for cid in t.chat_ids:
         tg_send_text(cid, info, "Markdown")
 
-def bootstrap_updates_offset():
-    """Inisialisasi offset untuk polling, sinkronkan ke update_id TERAKHIR"""
+def bootstrap_updates_offset(resume: bool = False):
+    """Inisialisasi offset untuk polling, sinkronkan ke update_id TERAKHIR.
+    resume=True: lanjut dari offset tersimpan agar update yang belum selesai diproses ulang"""
     try:
         tg_api("deleteWebhook", {})
         
+        if resume:
+            offset = load_offset()
+            if offset > 0:
+                LOG.info(f"[BOOTSTRAP] Lanjut dari offset tersimpan: {offset}")
+                return offset
+        
         # Ambil 1 update TERAKHIR (offset=-1) untuk sinkronisasi
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates?timeout=0&limit=1&offset=-1"
+        url = tg_url("getUpdates") + "?timeout=0&limit=1&offset=-1"
         status, data = http_get_json(url)
         
         if status == 200 and isinstance(data, dict):
@@ -508,43 +3639,52 @@ def bootstrap_updates_offset():
                 # Ambil update_id dari satu-satunya hasil
                 last = int(res[0].get("update_id", 0))
                 save_offset(last)
-                print(f"[BOOTSTRAP] Offset disinkronkan ke ID terakhir: {last}")
+                LOG.info(f"[BOOTSTRAP] Offset disinkronkan ke ID terakhir: {last}")
                 return last
         
         # Fallback jika gagal (misal bot baru, 0 updates)
         offset = load_offset()
-        print(f"[BOOTSTRAP] Offset lama dimuat: {offset}")
+        LOG.info(f"[BOOTSTRAP] Offset lama dimuat: {offset}")
         return offset
         
     except Exception as e:
-        print(f"[BOOTSTRAP_ERROR] {e}")
+        LOG.error(f"[BOOTSTRAP_ERROR] {e}")
         return load_offset()
 
 def daemon_run():
     """Jalankan bot dalam mode daemon (long polling)"""
     if not BOT_TOKEN:
-        print("❌ [ERROR] BOT_TOKEN kosong")
+        LOG.error("❌ [ERROR] BOT_TOKEN kosong")
         return
     
-    print("✅ Bot daemon dimulai...")
+    LOG.info("✅ Bot daemon dimulai...")
+    init_state()
+    load_cache_snapshot()
+    start_metrics()
+    start_config_watcher()
+    poll_updates()
+
+def poll_updates():
+    """Loop long polling getUpdates untuk tenant aktif"""
     send_startup_notification()
+    start_builtin_scheduler()
     
     offset = bootstrap_updates_offset()
-    base = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates"
+    base = tg_url("getUpdates")
     
     consecutive_errors = 0
     max_consecutive_errors = 5
     
     while True:
         try:
-            params = {"timeout": 50, "offset": offset + 1}
+            params = {"timeout": 50, "offset": offset + 1, "allowed_updates": ALLOWED_UPDATES}
             url = base + "?" + parse.urlencode(params)
-            status, data = http_get_json(url)
+            status, data = tg_get_updates(url)
             
             if status != 200 or not isinstance(data, dict):
                 consecutive_errors += 1
                 if consecutive_errors >= max_consecutive_errors:
-                    print(f"[WARNING] {consecutive_errors} errors berturut-turut, tunggu 5 detik...")
+                    LOG.warning(f"[WARNING] {consecutive_errors} errors berturut-turut, tunggu 5 detik...")
                     time.sleep(5.0)
                     consecutive_errors = 0
                 else:
@@ -559,56 +3699,501 @@ def daemon_run():
                     update_id = int(upd.get("update_id", 0))
                     offset = max(offset, update_id)
                     
-                    msg = upd.get("message") or upd.get("edited_message")
-                    if not msg:
-                        continue
-                    
-                    chat = msg.get("chat", {})
-                    chat_id = chat.get("id")
-                    text = msg.get("text", "")
-                    
-                    if chat_id is None or not text:
-                        continue
-                    
-                    print(f"[UPDATE] chat_id={chat_id}, text={text[:50]}")
-                    
-                    if not is_allowed_chat(chat_id):
-                        print(f"[BLOCKED] Unauthorized chat: {chat_id}")
+                    cmd = parse_update(upd)
+                    if cmd is None:
                         continue
                     
-                    print(f"[PROCESSING] Command from {chat_id}")
-                    handle_command(chat_id, text)
+                    dispatch_command(cmd)
                     
                 except Exception as e:
-                    print(f"[UPDATE_ERROR] {e}")
+                    LOG.error(f"[UPDATE_ERROR] {e}")
                     continue
             
             save_offset(offset)
             
         except KeyboardInterrupt:
-            print("\n✅ Bot dihentikan oleh user")
+            LOG.info("✅ Bot dihentikan oleh user")
             break
             
         except Exception as e:
             consecutive_errors += 1
-            print(f"[DAEMON_ERROR] {e}")
+            LOG.error(f"[DAEMON_ERROR] {e}")
             time.sleep(1.0)
 
+# ============= Telegram daemon (asyncio) =============
+class OffsetTracker:
+    """Offset yang di-commit hanya maju sampai update yang semua pendahulunya sudah selesai"""
+
+    def __init__(self, committed: int):
+        self.committed = committed
+        self.highest = committed
+        self.pending = set()
+
+    def seen(self, update_id: int):
+        self.highest = max(self.highest, update_id)
+
+    def begin(self, update_id: int):
+        self.seen(update_id)
+        self.pending.add(update_id)
+
+    def done(self, update_id: int):
+        self.pending.discard(update_id)
+
+    def commit(self) -> bool:
+        """Majukan & simpan offset jika bisa; True jika berubah"""
+        point = min(self.pending) - 1 if self.pending else self.highest
+        if point <= self.committed:
+            return False
+        self.committed = point
+        save_offset(point)
+        return True
+
+ASYNC_REPOLL = 1.0
+ASYNC_BATCH = 100         # limit getUpdates (maksimum Bot API)
+ASYNC_REPLAY_WINDOW = 80  # selisih update_id maksimum yang masih ditahan untuk diproses ulang
+
+async def _async_command(cmd, update_id, tracker):
+    """Task per perintah: serahkan ke antrian kerja, offset di-commit setelah perintah selesai"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def finished():
+        loop.call_soon_threadsafe(done.set_result, None)
+
+    try:
+        await loop.run_in_executor(None, dispatch_command, cmd, finished)
+        await done
+    except Exception as e:
+        LOG.error(f"[ASYNC_COMMAND_ERROR] {e}")
+    finally:
+        tracker.done(update_id)
+        tracker.commit()
+
+async def async_daemon_main():
+    """Loop asyncio: getUpdates terus berjalan, tiap perintah jadi task sendiri"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    loop = asyncio.get_running_loop()
+    poller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="poll")
+    tasks = set()
+
+    await loop.run_in_executor(poller, send_startup_notification)
+    offset = await loop.run_in_executor(poller, bootstrap_updates_offset, True)
+    tracker = OffsetTracker(offset)
+    base = tg_url("getUpdates")
+
+    consecutive_errors = 0
+    max_consecutive_errors = 5
+    lagging = False
+
+    try:
+        while True:
+            # Minta mulai dari offset yang sudah di-commit: update yang perintahnya belum selesai belum
+            # dikonfirmasi ke Telegram, jadi dikirim ulang jika proses mati sebelum perintahnya selesai.
+            # Jika tertinggal lebih dari ASYNC_REPLAY_WINDOW, satu batch bisa penuh berisi update lama
+            # saja; lanjut dari update tertinggi (update yang masih berjalan tidak diputar ulang lagi)
+            held = tracker.highest - tracker.committed <= ASYNC_REPLAY_WINDOW
+            if not held and not lagging:
+                LOG.warning(f"[ASYNC] {len(tracker.pending)} perintah lama masih berjalan, "
+                            f"update baru diambil tanpa menunggu (tidak diproses ulang jika restart)")
+            lagging = not held
+            start = tracker.committed if held else tracker.highest
+            params = {"timeout": 50, "offset": start + 1, "limit": ASYNC_BATCH,
+                      "allowed_updates": ALLOWED_UPDATES}
+            url = base + "?" + parse.urlencode(params)
+            status, data = await loop.run_in_executor(poller, tg_get_updates, url)
+
+            if status != 200 or not isinstance(data, dict):
+                consecutive_errors += 1
+                if consecutive_errors >= max_consecutive_errors:
+                    LOG.warning(f"[WARNING] {consecutive_errors} errors berturut-turut, tunggu 5 detik...")
+                    await asyncio.sleep(5.0)
+                    consecutive_errors = 0
+                else:
+                    await asyncio.sleep(1.0)
+                continue
+
+            consecutive_errors = 0
+            fresh = 0
+            for upd in data.get("result", []):
+                try:
+                    update_id = int(upd.get("update_id", 0))
+                    if update_id <= tracker.highest:
+                        continue  # sudah diterima, perintahnya masih berjalan
+                    fresh += 1
+                    cmd = parse_update(upd)
+                    if cmd is None:
+                        tracker.seen(update_id)
+                        continue
+
+                    tracker.begin(update_id)
+                    task = asyncio.create_task(_async_command(cmd, update_id, tracker))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                except Exception as e:
+                    LOG.error(f"[UPDATE_ERROR] {e}")
+
+            tracker.commit()
+            if tasks:
+                LOG.debug(f"[ASYNC] {len(tasks)} perintah berjalan")
+            if held and tracker.pending and not fresh:
+                # Selama ada update yang belum di-commit, getUpdates langsung kembali membawa update
+                # itu lagi; beri jeda agar tidak berputar cepat sambil menunggu perintahnya selesai
+                await asyncio.sleep(ASYNC_REPOLL)
+    finally:
+        for task in tasks:
+            task.cancel()
+        poller.shutdown(wait=False)
+
+def async_daemon_run():
+    """Jalankan bot dalam mode daemon asyncio (long polling non-blocking)"""
+    if not BOT_TOKEN:
+        LOG.error("❌ [ERROR] BOT_TOKEN kosong")
+        return
+
+    import asyncio
+    LOG.info("✅ Bot daemon (asyncio) dimulai...")
+    init_state()
+    configure_work_queue(ASYNC_MAX_TASKS, ASYNC_PER_CHAT)
+    load_cache_snapshot()
+    start_metrics()
+    start_config_watcher()
+    start_builtin_scheduler()
+    try:
+        asyncio.run(async_daemon_main())
+    except KeyboardInterrupt:
+        LOG.info("✅ Bot dihentikan oleh user")
+
+# ============= Telegram daemon (webhook) =============
+_WEBHOOK_SECRET_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+WEBHOOK_HANDSHAKE_TIMEOUT = 10.0
+
+def register_webhook(url: str, secret: str) -> bool:
+    """setWebhook dengan secret token; Telegram mengirim header X-Telegram-Bot-Api-Secret-Token"""
+    params = {
+        "url": url,
+        "secret_token": secret,
+        "allowed_updates": ALLOWED_UPDATES,
+    }
+    status, data = tg_api("setWebhook", params)
+    ok = status == 200 and isinstance(data, dict) and bool(data.get("ok"))
+    if ok:
+        LOG.info(f"[WEBHOOK] Terdaftar: {url}")
+    else:
+        LOG.error(f"[WEBHOOK_ERROR] setWebhook gagal: HTTP {status} {data}")
+    return ok
+
+class WebhookDispatcher:
+    """Penerima update webhook: update yang terkirim dua kali (update_id sama) dibuang,
+    perintahnya diserahkan ke antrian kerja sehingga request bisa segera dibalas"""
+
+    def __init__(self):
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, upd: dict) -> bool:
+        """Terima satu update; False jika update_id sudah pernah diterima"""
+        uid = upd.get("update_id")
+        with self._lock:
+            if uid in self._recent:
+                return False
+            self._recent[uid] = None
+            if len(self._recent) > 1024:
+                self._recent.popitem(last=False)
+        try:
+            cmd = parse_update(upd)
+            if cmd is not None:
+                dispatch_command(cmd)
+        except Exception as e:
+            LOG.error(f"[WEBHOOK_ERROR] {e}")
+        return True
+
+def start_webhook_server(dispatcher: WebhookDispatcher, path: str, secret: str,
+                         listen: str = "0.0.0.0", port: int = 8080):
+    """HTTP receiver: cek secret token, balas 200 segera, proses update di background"""
+    import hmac
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    expected = secret.encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        tls_failed = False
+
+        def setup(self):
+            # Handshake TLS per koneksi di thread handler, bukan saat accept(): klien lambat
+            # atau bukan-TLS tidak menahan listener dan koneksi lain
+            if isinstance(self.request, ssl.SSLSocket):
+                try:
+                    self.request.settimeout(WEBHOOK_HANDSHAKE_TIMEOUT)
+                    self.request.do_handshake()
+                    self.request.settimeout(None)
+                except (ssl.SSLError, OSError) as e:
+                    LOG.debug(f"[WEBHOOK] Handshake TLS gagal dari {self.client_address[0]}: {e}")
+                    self.tls_failed = True
+            super().setup()
+
+        def handle(self):
+            if not self.tls_failed:
+                super().handle()
+
+        def _reply(self, code: int):
+            if code != 200:
+                self.close_connection = True
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            if self.path.split("?", 1)[0] != path:
+                return self._reply(404)
+            got = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode("utf-8")
+            if not hmac.compare_digest(got, expected):
+                METRICS.inc("webhook_updates_total", result="unauthorized")
+                return self._reply(401)
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                return self._reply(400)
+            if length <= 0 or length > WEBHOOK_MAX_BODY:
+                return self._reply(413)
+            try:
+                upd = json.loads(self.rfile.read(length).decode("utf-8"))
+            except ValueError:
+                return self._reply(400)
+            if not isinstance(upd, dict):
+                return self._reply(400)
+            ok = dispatcher.submit(upd)
+            METRICS.inc("webhook_updates_total", result="accepted" if ok else "duplicate")
+            self._reply(200)
+
+        def do_GET(self):
+            self._reply(404)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((listen, port), Handler)
+    except OSError as e:
+        LOG.error(f"[WEBHOOK_ERROR] Gagal membuka {listen}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    if WEBHOOK_CERT and WEBHOOK_KEY:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    LOG.info(f"[WEBHOOK] Mendengarkan di {listen}:{port}{path}")
+    return server
+
+def webhook_run():
+    """Jalankan bot dalam mode webhook (tanpa long polling)"""
+    if not BOT_TOKEN:
+        LOG.error("❌ [ERROR] BOT_TOKEN kosong")
+        return
+    if not WEBHOOK_URL:
+        LOG.error("❌ [ERROR] WEBHOOK_URL kosong (URL HTTPS publik yang dipanggil Telegram)")
+        return
+    if WEBHOOK_SECRET and not _WEBHOOK_SECRET_RE.match(WEBHOOK_SECRET):
+        LOG.error("❌ [ERROR] WEBHOOK_SECRET hanya boleh huruf, angka, _ dan - (maks. 256)")
+        return
+
+    import secrets
+    LOG.info("✅ Bot webhook dimulai...")
+    init_state()
+    load_cache_snapshot()
+    start_metrics()
+    start_config_watcher()
+
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    path = WEBHOOK_PATH or parse.urlsplit(WEBHOOK_URL).path or "/"
+    dispatcher = WebhookDispatcher()
+    server = start_webhook_server(dispatcher, path, secret, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    if server is None:
+        return
+
+    send_startup_notification()
+    start_builtin_scheduler()
+    if not register_webhook(WEBHOOK_URL, secret):
+        server.server_close()
+        return
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        LOG.info("✅ Bot dihentikan oleh user")
+    finally:
+        server.server_close()
+
+# ============= Multi-tenant (banyak bot, beberapa proses) =============
+class HashRing:
+    """Consistent hashing tenant -> worker; menambah/menghapus tenant tidak memindah tenant lain"""
+
+    def __init__(self, nodes, vnodes: int = 64):
+        self._ring = sorted((self._hash(f"{n}#{i}"), n) for n in nodes for i in range(vnodes))
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        import hashlib
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str):
+        i = bisect_left(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[i][1]
+
+def load_tenants(path: str) -> list:
+    """Baca TENANTS_FILE (JSON: list tenant atau {"tenants": [...]}) -> [dict valid]"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("tenants", [])
+    tenants, names, tokens = [], set(), set()
+    for entry in data if isinstance(data, list) else []:
+        try:
+            t = Tenant.from_dict(entry)
+        except (ValueError, AttributeError) as e:
+            LOG.info(f"[TENANT] Diabaikan: {e}")
+            continue
+        if t.name in names or t.token in tokens:
+            LOG.info(f"[TENANT] Diabaikan: nama/token {t.name} dobel")
+            continue
+        names.add(t.name)
+        tokens.add(t.token)
+        tenants.append(entry)
+    return tenants
+
+def shard_tenants(entries: list, workers: int) -> dict:
+    """{index worker: [entri tenant]} via consistent hashing nama tenant"""
+    ring = HashRing(range(workers))
+    shards = {i: [] for i in range(workers)}
+    for entry in entries:
+        shards[ring.node_for(str(entry.get("name")))].append(entry)
+    return {i: v for i, v in shards.items() if v}
+
+def _tenant_poll_thread(t: Tenant):
+    with use_tenant(t):
+        while True:
+            try:
+                poll_updates()
+                return
+            except Exception as e:
+                LOG.error(f"[TENANT_ERROR] {t.name}: {e}")
+                time.sleep(5.0)
+
+def _tenant_worker(index: int, entries: list):
+    """Proses worker: satu thread long polling per tenant; transport & cache dipakai bersama,
+    riwayat dan state tiap tenant di file `<nama>` sendiri (sama dengan --cron)"""
+    global CACHE_FILE, STATE_FILE, METRICS_FILE
+    CACHE_FILE = os.path.join(STATE_DIR, f"quota_cache.w{index}.json")
+    STATE_FILE = os.path.join(STATE_DIR, f"state.w{index}.json")
+    METRICS_FILE = os.path.join(STATE_DIR, f"metrics.w{index}.json")
+    set_transport(make_transport(HTTP_TRANSPORT))
+    init_state()
+    load_cache_snapshot()
+    if METRICS_PORT > 0:
+        start_metrics_server(METRICS_PORT + index, METRICS_BIND)
+    if METRICS_DUMP_INTERVAL > 0:
+        threading.Thread(target=_metrics_dump_loop, args=(METRICS_DUMP_INTERVAL,),
+                         name="metrics-dump", daemon=True).start()
+
+    tenants = [Tenant.from_dict(e) for e in entries]
+    LOG.info(f"[TENANT] Worker {index}: {', '.join(t.name for t in tenants)}")
+    threads = [threading.Thread(target=_tenant_poll_thread, args=(t,), name=f"tenant-{t.name}", daemon=True)
+               for t in tenants]
+    for th in threads:
+        th.start()
+    try:
+        for th in threads:
+            th.join()
+    finally:
+        # Proses anak multiprocessing keluar lewat os._exit, atexit tidak dijalankan
+        flush_state()
+        LOG.flush()
+
+def tenants_run():
+    """Mode multi-tenant: tenant dari TENANTS_FILE dibagi ke TENANT_WORKERS proses"""
+    import multiprocessing
+    try:
+        entries = load_tenants(TENANTS_FILE)
+    except Exception as e:
+        LOG.error(f"❌ [ERROR] Gagal membaca TENANTS_FILE: {e}")
+        return
+    if not entries:
+        LOG.error("❌ [ERROR] Tidak ada tenant valid di TENANTS_FILE")
+        return
+
+    init_state()
+    workers = max(1, min(TENANT_WORKERS, len(entries)))
+    shards = shard_tenants(entries, workers)
+    LOG.info(f"✅ Multi-tenant: {len(entries)} tenant di {len(shards)} proses worker")
+
+    procs = {}
+
+    def spawn(i):
+        proc = multiprocessing.Process(target=_tenant_worker, args=(i, shards[i]), name=f"tenant-w{i}")
+        proc.start()
+        procs[i] = proc
+
+    for i in shards:
+        spawn(i)
+    try:
+        while True:
+            time.sleep(5.0)
+            for i, proc in list(procs.items()):
+                if not proc.is_alive():
+                    LOG.info(f"[TENANT] Worker {i} berhenti (exit {proc.exitcode}), dijalankan ulang")
+                    spawn(i)
+    except KeyboardInterrupt:
+        LOG.info("✅ Bot dihentikan oleh user")
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+
+def tenants_cron_run(report: bool = False):
+    """--cron / --report untuk semua tenant di TENANTS_FILE, berurutan dalam satu proses"""
+    try:
+        entries = load_tenants(TENANTS_FILE)
+    except Exception as e:
+        LOG.error(f"[ERROR] Gagal membaca TENANTS_FILE: {e}")
+        return
+    for entry in entries:
+        t = Tenant.from_dict(entry)
+        if not t.chat_ids or not t.msisdns:
+            LOG.info(f"[CRON] Tenant {t.name}: chat_id/msisdn_list kosong, dilewati")
+            continue
+        with use_tenant(t):
+            if report:
+                run_report_pipeline(f"REPORT:{t.name}", fmt=REPORT_FORMAT)
+            else:
+                run_check_pipeline(f"CRON:{t.name}")
+
 # ============= main =============
+_STARTUP.append(("init", time.perf_counter()))
+
 def main():
     """Main entry point"""
     try:
-        if "--cron" in sys.argv:
-            print("🕐 Menjalankan mode CRON...")
+        LOG.info(f"[STARTUP] {startup_report()}")
+        if "--cron" in sys.argv or "--report" in sys.argv:
+            LOG.info("📄 Menjalankan mode LAPORAN..." if "--report" in sys.argv else "🕐 Menjalankan mode CRON...")
             cron_run()
+        elif "--webhook" in sys.argv or DAEMON_MODE == "webhook":
+            LOG.info("🌐 Menjalankan mode WEBHOOK...")
+            webhook_run()
+        elif TENANTS_FILE:
+            LOG.info("🚀 Menjalankan mode DAEMON multi-tenant...")
+            tenants_run()
+        elif "--async" in sys.argv or DAEMON_MODE == "async":
+            LOG.info("🚀 Menjalankan mode DAEMON (asyncio)...")
+            async_daemon_run()
         else:
-            print("🚀 Menjalankan mode DAEMON...")
+            LOG.info("🚀 Menjalankan mode DAEMON...")
             daemon_run()
     except KeyboardInterrupt:
-        print("\n✅ Program dihentikan")
+        LOG.info("✅ Program dihentikan")
         sys.exit(0)
     except Exception as e:
-        print(f"❌ [FATAL] {e}\n{traceback.format_exc()}")
+        LOG.error(f"❌ [FATAL] {e}\n{format_exc()}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -12,9 +12,11 @@ PY_PATH="${INSTALL_DIR}/${PY_FILE}"
 
 RC_LOCAL="/etc/rc.local"
 # Baris baru untuk rc.local (tanpa .env)
-RC_LINE_DAEMON="nohup python3 ${PY_PATH} >/tmp/cekkuota_daemon.log 2>&1 &"
+# Log daemon ditulis bot sendiri ke LOG_FILE (dirotasi); stdout hanya menangkap crash
+RC_LINE_DAEMON="LOG_FILE=/tmp/cekkuota_daemon.log nohup python3 ${PY_PATH} >/tmp/cekkuota_daemon.out 2>&1 &"
 # Baris lama yang mungkin ada dan perlu dihapus
 RC_LINE_OLD_ENV=". /root/cekkuota.env"
+RC_LINE_OLD_DAEMON="^nohup python3 ${PY_PATH} >/tmp/cekkuota_daemon.log 2>&1 &$"
 
 echo "[*] Menyiapkan direktori: ${INSTALL_DIR}"
 mkdir -p "$INSTALL_DIR"
@@ -615,12 +617,14 @@ rm -f "${TMP_CRON}"
 echo "[*] Menjalankan daemon bot (long polling)…"
 pkill -f "python3 ${PY_PATH}" >/dev/null 2>&1 || true
 # Perintah daemon baru, tidak pakai "sh -c '. ${ENV_FILE}; ...'"
-nohup python3 "${PY_PATH}" >/tmp/cekkuota_daemon.log 2>&1 &
+LOG_FILE=/tmp/cekkuota_daemon.log nohup python3 "${PY_PATH}" >/tmp/cekkuota_daemon.out 2>&1 &
 
 echo "[*] Pasang auto-start di boot (${RC_LOCAL})…"
 if [ -f "${RC_LOCAL}" ]; then
   # Hapus baris .env lama jika ada
   sed -i "\|${RC_LINE_OLD_ENV}|d" "${RC_LOCAL}"
+  # Hapus baris daemon lama (stdout tanpa rotasi) jika ada
+  sed -i "\|${RC_LINE_OLD_DAEMON}|d" "${RC_LOCAL}"
   
   # Tambahkan baris daemon baru jika belum ada
   grep -Fqx "${RC_LINE_DAEMON}" "${RC_LOCAL}" || echo "${RC_LINE_DAEMON}" >> "${RC_LOCAL}"